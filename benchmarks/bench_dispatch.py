@@ -0,0 +1,104 @@
+"""Microbenchmark: ordinary (non-command) messages handled per second by on_message's parsing.
+
+Compares the Dispatcher against the previous startswith chain, which ran an
+admin role check on every message and then looped over every command prefix
+building f-strings. Run from the repository root: python benchmarks/bench_dispatch.py
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from dispatch import Dispatcher
+
+MESSAGES = 200_000
+ROLES_PER_MEMBER = 8
+ADMIN_ROLE_NAME = "Admin"
+BOT_ID = 1234567890
+COMMAND_PREFIXES = [
+    "tutorplus", "tutorminus", "imageplus", "standardplus", "standardminus", "tutor", "image",
+    "standard", "tut+", "tut-", "tut", "ti+", "ti", "tn+", "tn-", "tn", "t+", "t-", "t",
+]
+ADMIN_COMMANDS = ["setgloballimit", "setuserlimit", "removelimit", "togglebot", "enablebot"]
+CHATTER = [
+    "anyone done the chem homework yet?",
+    "lol",
+    "what time is the test tomorrow",
+    "can someone explain question 4 from the worksheet, I don't get how they got 12",
+    "$5 says the quiz is open book",
+]
+
+class Role:
+    def __init__(self, name):
+        self.name = name
+
+def legacy_is_admin(roles):
+    for role in roles:
+        if role.name == ADMIN_ROLE_NAME:
+            return True
+    return False
+
+def legacy_parse(content, roles, mentioned):
+    """The old on_message flow, minus the sends"""
+    content_lower = content.lower()
+    if content_lower.startswith("$help") or content_lower.startswith("$clear"):
+        return "builtin"
+    if legacy_is_admin(roles):
+        for name in ADMIN_COMMANDS:
+            if content_lower.startswith(f"${name}"):
+                return name
+
+    if content.startswith("$"):
+        for prefix in COMMAND_PREFIXES:
+            if content_lower.startswith(f"${prefix} ") or content_lower == f"${prefix}":
+                return prefix
+    if mentioned:
+        clean_content = content.replace(f'<@{BOT_ID}>', '').strip()
+        for prefix in COMMAND_PREFIXES:
+            if clean_content.lower().startswith(f"{prefix} ") or clean_content.lower() == prefix:
+                return prefix
+        return "tutor"
+    return None
+
+def build_dispatcher():
+    dispatcher = Dispatcher(prefix="$")
+    for name in ("help", "clear"):
+        dispatcher.add(name, name)
+    for name in ADMIN_COMMANDS:
+        dispatcher.add(name, name, admin=True)
+    for prefix in COMMAND_PREFIXES:
+        dispatcher.add(prefix, prefix, mention=True)
+    dispatcher.set_default_mention("tutor", "tutor")
+    return dispatcher
+
+def bench_dispatcher(messages):
+    dispatcher = build_dispatcher()
+    begin = time.perf_counter()
+    for content, roles, mentioned in messages:
+        route, query = dispatcher.resolve(content, f'<@{BOT_ID}>' if mentioned else None)
+        if route is not None and route.admin:
+            legacy_is_admin(roles)
+    return MESSAGES / (time.perf_counter() - begin)
+
+def bench_legacy(messages):
+    begin = time.perf_counter()
+    for content, roles, mentioned in messages:
+        legacy_parse(content, roles, mentioned)
+    return MESSAGES / (time.perf_counter() - begin)
+
+def main():
+    random.seed(0)
+    roles = [Role(f"role-{i}") for i in range(ROLES_PER_MEMBER)]
+    messages = [(random.choice(CHATTER), roles, False) for _ in range(MESSAGES)]
+
+    dispatcher_rate = bench_dispatcher(messages)
+    legacy_rate = bench_legacy(messages)
+    print(f"{MESSAGES:,} non-command messages, {ROLES_PER_MEMBER} roles per member")
+    print(f"Dispatcher:        {dispatcher_rate:>12,.0f} messages/s")
+    print(f"Legacy chain:      {legacy_rate:>12,.0f} messages/s")
+    print(f"Speedup:           {dispatcher_rate / legacy_rate:>12.1f}x")
+
+if __name__ == "__main__":
+    main()
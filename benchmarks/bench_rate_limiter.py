@@ -0,0 +1,68 @@
+"""Microbenchmark: rate limit checks per second with 100k active users.
+
+Compares RateLimiter against the previous list-rebuilding check_rate_limit.
+Run from the repository root: python benchmarks/bench_rate_limiter.py
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from rate_limiter import RateLimiter
+
+USERS = 100_000
+EVENTS_PER_USER = 20  # Recent messages already recorded per user
+CHECKS = 200_000
+COMMAND = "normal"
+LIMIT = {"per_minute": 1000, "per_10min": 1000, "per_hour": 1000}
+
+def legacy_check(user_messages, user_id, now):
+    """The old approach: rebuild the list, then scan it once per window"""
+    user_messages[user_id] = [ts for ts in user_messages[user_id] if now - ts < 3600]
+    timestamps = user_messages[user_id]
+    for key, span in (("per_minute", 60), ("per_10min", 600), ("per_hour", 3600)):
+        if len([ts for ts in timestamps if now - ts < span]) >= LIMIT[key]:
+            return False
+    return True
+
+def bench_limiter(start, order):
+    limiter = RateLimiter()
+    for user_id in range(USERS):
+        for i in range(EVENTS_PER_USER):
+            limiter.record(user_id, COMMAND, start + i)
+
+    now = start + EVENTS_PER_USER
+    begin = time.perf_counter()
+    for user_id in order:
+        if limiter.exceeded(user_id, COMMAND, LIMIT, now) is None:
+            limiter.record(user_id, COMMAND, now)
+    return CHECKS / (time.perf_counter() - begin)
+
+def bench_legacy(start, order):
+    user_messages = {
+        user_id: [start + i for i in range(EVENTS_PER_USER)] for user_id in range(USERS)
+    }
+
+    now = start + EVENTS_PER_USER
+    begin = time.perf_counter()
+    for user_id in order:
+        if legacy_check(user_messages, user_id, now):
+            user_messages[user_id].append(now)
+    return CHECKS / (time.perf_counter() - begin)
+
+def main():
+    random.seed(0)
+    start = time.time()
+    order = [random.randrange(USERS) for _ in range(CHECKS)]
+
+    limiter_rate = bench_limiter(start, order)
+    legacy_rate = bench_legacy(start, order)
+    print(f"{USERS:,} active users, {EVENTS_PER_USER} recent events each, {CHECKS:,} checks")
+    print(f"RateLimiter:       {limiter_rate:>12,.0f} checks/s")
+    print(f"Legacy list scan:  {legacy_rate:>12,.0f} checks/s")
+    print(f"Speedup:           {limiter_rate / legacy_rate:>12.1f}x")
+
+if __name__ == "__main__":
+    main()
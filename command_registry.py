@@ -0,0 +1,70 @@
+class CommandSpec:
+    """One model command and the request policy its requests run under.
+
+    name is both the slash command and the $/mention command; aliases are
+    extra $/mention shortcuts. token_budget caps the prompt sent to the
+    model, cacheable lets stateless requests be answered from the response
+    cache, concurrency caps the model's in-flight requests (None uses the
+    default), fallback names the command raced against a slow start, and
+    options are extra request parameters sent to Poe.
+    """
+    __slots__ = ("name", "model", "label", "tutor", "command_type", "aliases", "image",
+                 "token_budget", "cacheable", "concurrency", "fallback", "options")
+
+    def __init__(self, name, model, label, tutor, command_type, aliases=(), image=False,
+                 token_budget=None, cacheable=False, concurrency=None, fallback=None, options=None):
+        self.name = name
+        self.model = model
+        self.label = label
+        self.tutor = tutor
+        self.command_type = command_type
+        self.aliases = aliases
+        self.image = image
+        self.token_budget = token_budget
+        self.cacheable = cacheable
+        self.concurrency = concurrency
+        self.fallback = fallback
+        self.options = options or {}
+
+    @property
+    def description(self):
+        if self.image:
+            return f"Generate image with {self.label}"
+        if self.tutor:
+            return f"Ask Mr. Tutor ({self.label})"
+        return f"Ask {self.label} (no tutor prompt)"
+
+# Every model command, in help order. Tutor commands are never cached so
+# their replies stay personalized.
+COMMANDS = (
+    CommandSpec("tutor", "tester-kimi-k2-non", "Kimi-K2-Instruct", True, "normal",
+                aliases=("tut", "t"), token_budget=32000, fallback="tutorminus"),
+    CommandSpec("tutorplus", "Gemini-2.5-Flash-Tut", "Gemini-2.5-Flash", True, "plus",
+                aliases=("tut+", "t+"), token_budget=64000),
+    CommandSpec("tutorminus", "Gemini-2.5-Flash-Lite", "Gemini-2.5-Flash-Lite", True, "minus",
+                aliases=("tut-", "t-"), token_budget=32000),
+    CommandSpec("standard", "tester-kimi-k2-non", "Kimi-K2-Instruct", False, "nonnormal",
+                aliases=("tn",), token_budget=32000, cacheable=True, fallback="standardminus"),
+    CommandSpec("standardplus", "Gemini-2.5-Flash-Tut", "Gemini-2.5-Flash", False, "nonplus",
+                aliases=("tn+",), token_budget=64000, cacheable=True),
+    CommandSpec("standardminus", "Gemini-2.5-Flash-Lite", "Gemini-2.5-Flash-Lite", False, "nonminus",
+                aliases=("tn-",), token_budget=32000, cacheable=True),
+    CommandSpec("image", "FLUX-schnell", "FLUX-schnell", False, "image",
+                aliases=("ti",), image=True, cacheable=True, concurrency=4),
+    CommandSpec("imageplus", "GPT-Image-1-Mini", "GPT-Image-1-Mini (low quality)", False, "imageplus",
+                aliases=("ti+",), image=True, cacheable=True, concurrency=4, options={"quality": "low"}),
+)
+
+# Command run when the bot is mentioned without a command name
+DEFAULT_MENTION_COMMAND = "tutor"
+
+COMMANDS_BY_NAME = {spec.name: spec for spec in COMMANDS}
+COMMANDS_BY_TYPE = {spec.command_type: spec for spec in COMMANDS}
+
+def model_concurrency_limits():
+    """In-flight limit per model; a model shared by several commands gets the smallest"""
+    limits = {}
+    for spec in COMMANDS:
+        if spec.concurrency is not None:
+            limits[spec.model] = min(spec.concurrency, limits.get(spec.model, spec.concurrency))
+    return limits
@@ -0,0 +1,198 @@
+import asyncio
+import json
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS turns (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    history TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS turns_by_user ON turns (history, user_id, id);
+
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    data BLOB NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS turn_blobs (
+    turn_id INTEGER NOT NULL REFERENCES turns (id) ON DELETE CASCADE,
+    hash TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS turn_blobs_by_turn ON turn_blobs (turn_id);
+CREATE INDEX IF NOT EXISTS turn_blobs_by_hash ON turn_blobs (hash);
+
+CREATE TABLE IF NOT EXISTS summaries (
+    history TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    summary TEXT NOT NULL,
+    PRIMARY KEY (history, user_id)
+);
+"""
+
+def log_failure(future):
+    if future.exception():
+        log.error("Conversation store error: %s", future.exception())
+
+class ConversationStore:
+    """SQLite (WAL mode) store for conversation turns.
+
+    Every query runs on a single worker thread, which owns the connection,
+    so writes keep their order and the event loop never waits on disk.
+    Writes are fire-and-forget; reads are awaited. Nothing is loaded until
+    a user's history is asked for.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = None
+        self.dirty = False  # Turns were deleted since the last blob cleanup
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+
+    def _connection(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute("PRAGMA foreign_keys=ON")
+            self.conn.executescript(SCHEMA)
+        return self.conn
+
+    def _submit(self, fn, *args):
+        self.executor.submit(fn, *args).add_done_callback(log_failure)
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, fn, *args)
+
+    # Writes
+
+    def append(self, history, user_id, role, content, payloads):
+        """Queue a turn; content is JSON-ready, payloads maps blob hash to bytes or str"""
+        self._submit(self._append, history, user_id, role, json.dumps(content), payloads)
+
+    def _append(self, history, user_id, role, content, payloads):
+        conn = self._connection()
+        with conn:
+            for key, payload in payloads.items():
+                data = payload.encode('utf-8') if isinstance(payload, str) else payload
+                conn.execute("INSERT OR IGNORE INTO blobs (hash, data) VALUES (?, ?)", (key, data))
+            cursor = conn.execute(
+                "INSERT INTO turns (history, user_id, role, content) VALUES (?, ?, ?, ?)",
+                (history, user_id, role, content)
+            )
+            conn.executemany(
+                "INSERT INTO turn_blobs (turn_id, hash) VALUES (?, ?)",
+                [(cursor.lastrowid, key) for key in payloads]
+            )
+
+    def keep_latest(self, history, user_id, count):
+        """Queue deletion of all but a user's newest count turns"""
+        self._submit(self._keep_latest, history, user_id, count)
+
+    def _keep_latest(self, history, user_id, count):
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                """DELETE FROM turns WHERE history = ? AND user_id = ? AND id NOT IN (
+                       SELECT id FROM turns WHERE history = ? AND user_id = ?
+                       ORDER BY id DESC LIMIT ?)""",
+                (history, user_id, history, user_id, count)
+            )
+        self.dirty = True
+
+    def save_summary(self, history, user_id, summary):
+        self._submit(self._save_summary, history, user_id, summary)
+
+    def _save_summary(self, history, user_id, summary):
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO summaries (history, user_id, summary) VALUES (?, ?, ?)",
+                (history, user_id, summary)
+            )
+
+    def delete_user(self, history, user_id):
+        self._submit(self._delete_user, history, user_id)
+
+    def _delete_user(self, history, user_id):
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM turns WHERE history = ? AND user_id = ?", (history, user_id))
+            conn.execute("DELETE FROM summaries WHERE history = ? AND user_id = ?", (history, user_id))
+        self.dirty = True
+
+    # Reads
+
+    async def load(self, history, user_id, limit):
+        """Return (rows, payloads, summary) for a user's newest limit turns"""
+        return await self._run(self._load, history, user_id, limit)
+
+    def _load(self, history, user_id, limit):
+        conn = self._connection()
+        turns = conn.execute(
+            "SELECT id, role, content FROM turns WHERE history = ? AND user_id = ? ORDER BY id DESC LIMIT ?",
+            (history, user_id, limit)
+        ).fetchall()
+        turns.reverse()
+
+        payloads = {}
+        if turns:
+            blob_rows = conn.execute(
+                """SELECT DISTINCT blobs.hash, blobs.data FROM turn_blobs
+                   JOIN blobs ON blobs.hash = turn_blobs.hash
+                   WHERE turn_blobs.turn_id >= ? AND turn_blobs.turn_id IN (
+                       SELECT id FROM turns WHERE history = ? AND user_id = ?)""",
+                (turns[0][0], history, user_id)
+            ).fetchall()
+            payloads = {key: data for key, data in blob_rows}
+
+        summary = conn.execute(
+            "SELECT summary FROM summaries WHERE history = ? AND user_id = ?",
+            (history, user_id)
+        ).fetchone()
+        rows = [(role, json.loads(content)) for _, role, content in turns]
+        return rows, payloads, summary[0] if summary else None
+
+    async def has_user(self, history, user_id):
+        """Whether any turns or a summary are stored for a user"""
+        return await self._run(self._has_user, history, user_id)
+
+    def _has_user(self, history, user_id):
+        conn = self._connection()
+        row = conn.execute(
+            """SELECT EXISTS (SELECT 1 FROM turns WHERE history = ? AND user_id = ?)
+                   OR EXISTS (SELECT 1 FROM summaries WHERE history = ? AND user_id = ?)""",
+            (history, user_id, history, user_id)
+        ).fetchone()
+        return bool(row[0])
+
+    # Maintenance
+
+    async def collect_garbage(self):
+        """Delete blobs no longer referenced by any turn"""
+        await self._run(self._collect_garbage)
+
+    def _collect_garbage(self):
+        if not self.dirty:
+            return
+        self.dirty = False
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM blobs WHERE hash NOT IN (SELECT hash FROM turn_blobs)")
+
+    def close(self):
+        """Finish queued writes and close the connection"""
+        self.executor.submit(self._close)
+        self.executor.shutdown(wait=True)
+
+    def _close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
@@ -0,0 +1,64 @@
+class Route:
+    """A command's handler, called as handler(message, query)"""
+    __slots__ = ("name", "handler", "admin")
+
+    def __init__(self, name, handler, admin=False):
+        self.name = name
+        self.handler = handler
+        self.admin = admin
+
+def split_first(text):
+    """Return (lowercased first token, rest of the text)"""
+    parts = text.split(None, 1)
+    if not parts:
+        return "", ""
+    return parts[0].lower(), parts[1].strip() if len(parts) > 1 else ""
+
+class Dispatcher:
+    """Resolves a message to a command with one dict lookup on its first token.
+
+    Commands are registered once at startup, for the prefix form
+    ("$tutor ..."), the mention form ("@bot tutor ..."), or both. Messages
+    that neither start with the prefix nor mention the bot are rejected
+    before any parsing.
+    """
+
+    def __init__(self, prefix="$"):
+        self.prefix = prefix
+        self.prefix_routes = {}
+        self.mention_routes = {}
+        self.default_mention = None
+
+    def add(self, name, handler, prefix=True, mention=False, admin=False):
+        route = Route(name, handler, admin)
+        if prefix:
+            self.prefix_routes[name.lower()] = route
+        if mention:
+            self.mention_routes[name.lower()] = route
+        return route
+
+    def set_default_mention(self, name, handler):
+        """Handler for a mention that doesn't name a command; it gets the whole text"""
+        self.default_mention = Route(name, handler)
+
+    def resolve(self, content, mention=None):
+        """Return (route, query) for a message, or (None, None).
+
+        mention is the bot's mention string when the message mentions it.
+        """
+        if content.startswith(self.prefix):
+            token, query = split_first(content[len(self.prefix):])
+            route = self.prefix_routes.get(token)
+            if route is not None:
+                return route, query
+
+        if mention is not None:
+            clean_content = content.replace(mention, '').strip()
+            token, query = split_first(clean_content)
+            route = self.mention_routes.get(token)
+            if route is not None:
+                return route, query
+            if self.default_mention is not None:
+                return self.default_mention, clean_content
+
+        return None, None
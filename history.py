@@ -0,0 +1,335 @@
+import base64
+import hashlib
+import time
+from collections import OrderedDict
+
+BLOB_MIN_SIZE = 1024  # Text parts at least this long are stored in the blob store
+
+# Rough token estimates; close enough for budgeting without a tokenizer
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4
+IMAGE_TOKENS = 1024
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+class BlobStore:
+    """Content-addressed, reference-counted storage for large message payloads"""
+
+    def __init__(self):
+        self.blobs = {}
+        self.refs = {}
+        self.total_bytes = 0
+
+    def put(self, payload):
+        """Store payload (bytes or str) once and return its hash"""
+        data = payload.encode('utf-8') if isinstance(payload, str) else payload
+        key = hashlib.sha256(data).hexdigest()
+        if key in self.blobs:
+            self.refs[key] += 1
+        else:
+            self.blobs[key] = payload
+            self.refs[key] = 1
+            self.total_bytes += len(data)
+        return key
+
+    def get(self, key):
+        return self.blobs[key]
+
+    def size(self, key):
+        payload = self.blobs[key]
+        return len(payload.encode('utf-8')) if isinstance(payload, str) else len(payload)
+
+    def release(self, key):
+        self.refs[key] -= 1
+        if self.refs[key] <= 0:
+            self.total_bytes -= self.size(key)
+            del self.blobs[key]
+            del self.refs[key]
+
+    def __len__(self):
+        return len(self.blobs)
+
+class Message:
+    """One conversation turn.
+
+    content is either the plain text of the turn or a tuple of parts:
+    ("text", text), ("text_ref", hash, label), ("image", mime, hash) or
+    ("image_url", url). tokens is the estimated size of the full turn and
+    stub_tokens its size with attachments replaced by short placeholders.
+    size approximates the bytes held for the turn, including its blobs.
+    """
+    __slots__ = ("role", "content", "tokens", "stub_tokens", "size")
+
+    def __init__(self, role, content, blobs):
+        self.role = role
+        self.content = content
+        if isinstance(content, str):
+            self.tokens = self.stub_tokens = MESSAGE_OVERHEAD_TOKENS + estimate_tokens(content)
+            self.size = len(content)
+        else:
+            self.size = sum(
+                blobs.size(part[2]) if part[0] == "image" else
+                blobs.size(part[1]) if part[0] == "text_ref" else len(part[1])
+                for part in content
+            )
+            self.tokens = MESSAGE_OVERHEAD_TOKENS + sum(part_tokens(part, blobs) for part in content)
+            self.stub_tokens = MESSAGE_OVERHEAD_TOKENS + sum(
+                estimate_tokens(stub_part(part)[1]) for part in content
+            )
+
+    def blob_keys(self):
+        if isinstance(self.content, str):
+            return
+        for part in self.content:
+            if part[0] == "text_ref":
+                yield part[1]
+            elif part[0] == "image":
+                yield part[2]
+
+def pack_part(part, blobs):
+    """Convert an OpenAI content part into a compact tuple, moving payloads to blobs"""
+    if part["type"] == "image_url":
+        url = part["image_url"]["url"]
+        if url.startswith("data:") and ";base64," in url:
+            header, data = url.split(",", 1)
+            mime = header[len("data:"):-len(";base64")]
+            return ("image", mime, blobs.put(base64.b64decode(data)))
+        return ("image_url", url)
+
+    text = part.get("text", "")
+    if len(text) >= BLOB_MIN_SIZE:
+        label = text.split("\n", 1)[0][:80]
+        return ("text_ref", blobs.put(text), label)
+    return ("text", text)
+
+def part_tokens(part, blobs):
+    kind = part[0]
+    if kind == "text":
+        return estimate_tokens(part[1])
+    if kind == "text_ref":
+        return estimate_tokens(blobs.get(part[1]))
+    return IMAGE_TOKENS
+
+def stub_part(part):
+    """Placeholder text part for an attachment dropped from an older turn"""
+    kind = part[0]
+    if kind == "text":
+        return part
+    if kind == "text_ref":
+        return ("text", f"[Earlier attachment omitted: {part[2]}]")
+    return ("text", "[Earlier image omitted]")
+
+def message_text(message):
+    """Plain-text rendering of a turn with attachments as placeholders"""
+    if isinstance(message.content, str):
+        return message.content
+    return "\n".join(stub_part(part)[1] for part in message.content)
+
+def unpack_part(part, blobs):
+    """Rebuild the OpenAI content part for a compact tuple"""
+    kind = part[0]
+    if kind == "text":
+        return {"type": "text", "text": part[1]}
+    if kind == "text_ref":
+        return {"type": "text", "text": blobs.get(part[1])}
+    if kind == "image":
+        data = base64.b64encode(blobs.get(part[2])).decode('utf-8')
+        return {"type": "image_url", "image_url": {"url": f"data:{part[1]};base64,{data}"}}
+    return {"type": "image_url", "image_url": {"url": part[1]}}
+
+class ConversationHistory:
+    """Per-user message records sharing one BlobStore.
+
+    summaries holds a running summary of turns that were folded out of a
+    user's history by compaction. users is kept in least-recently-used
+    order so idle and excess users can be evicted cheaply.
+
+    When a store is given, every change is mirrored to it under name, and
+    unloaded users can be restored from it with load().
+    """
+
+    def __init__(self, blobs, max_length, store=None, name=None):
+        self.blobs = blobs
+        self.max_length = max_length
+        self.store = store
+        self.name = name
+        self.users = OrderedDict()
+        self.tokens = {}
+        self.summaries = {}
+        self.last_used = {}
+        self.total_bytes = 0
+
+    def __contains__(self, user_id):
+        return user_id in self.users
+
+    def __len__(self):
+        return len(self.users)
+
+    def append(self, user_id, role, content):
+        """Record a turn given OpenAI-style content (a string or a list of parts)"""
+        if not isinstance(content, str):
+            content = tuple(pack_part(part, self.blobs) for part in content)
+        message = Message(role, content, self.blobs)
+        turns = self.users.setdefault(user_id, [])
+        turns.append(message)
+        self.tokens[user_id] = self.tokens.get(user_id, 0) + message.tokens
+        self.total_bytes += message.size
+        self.touch(user_id)
+        if self.store:
+            payloads = {key: self.blobs.get(key) for key in message.blob_keys()}
+            content = content if isinstance(content, str) else [list(part) for part in content]
+            self.store.append(self.name, user_id, role, content, payloads)
+        if len(turns) > self.max_length:
+            self.drop(user_id, len(turns) - self.max_length)
+            if self.store:
+                self.store.keep_latest(self.name, user_id, self.max_length)
+
+    def drop(self, user_id, count):
+        """Remove the oldest count turns of a user"""
+        turns = self.users[user_id]
+        for message in turns[:count]:
+            self.tokens[user_id] -= message.tokens
+            self.total_bytes -= message.size
+            for key in message.blob_keys():
+                self.blobs.release(key)
+        del turns[:count]
+
+    def unload(self, user_id):
+        """Remove a user's history from memory only; returns whether it was loaded"""
+        if user_id not in self.users:
+            return False
+        self.drop(user_id, len(self.users[user_id]))
+        del self.users[user_id]
+        del self.tokens[user_id]
+        self.summaries.pop(user_id, None)
+        self.last_used.pop(user_id, None)
+        return True
+
+    async def exists(self, user_id):
+        """Whether a user has any history, in memory or stored, without loading it"""
+        if user_id in self.users:
+            return True
+        return self.store is not None and await self.store.has_user(self.name, user_id)
+
+    def clear(self, user_id):
+        """Forget a user's history, including the stored copy; returns whether it was loaded"""
+        if self.store:
+            self.store.delete_user(self.name, user_id)
+        return self.unload(user_id)
+
+    async def load(self, user_id):
+        """Restore a user's history from the store unless it's already in memory"""
+        if self.store is None or user_id in self.users:
+            return
+        rows, payloads, summary = await self.store.load(self.name, user_id, self.max_length)
+        # Another command may have loaded or started this history meanwhile
+        if user_id in self.users or not (rows or summary):
+            return
+
+        turns = []
+        for role, content in rows:
+            if not isinstance(content, str):
+                content = tuple(self.restore_part(part, payloads) for part in content)
+            turns.append(Message(role, content, self.blobs))
+        self.users[user_id] = turns
+        self.tokens[user_id] = sum(message.tokens for message in turns)
+        self.total_bytes += sum(message.size for message in turns)
+        if summary:
+            self.summaries[user_id] = summary
+        self.touch(user_id)
+
+    def restore_part(self, part, payloads):
+        """Rebuild a stored part, re-registering its payload in the blob store"""
+        kind = part[0]
+        if kind == "image" and part[2] in payloads:
+            return ("image", part[1], self.blobs.put(payloads[part[2]]))
+        if kind == "text_ref" and part[1] in payloads:
+            return ("text_ref", self.blobs.put(payloads[part[1]].decode('utf-8')), part[2])
+        if kind in ("image", "text_ref"):
+            return stub_part(tuple(part))
+        return tuple(part)
+
+    def touch(self, user_id):
+        """Mark a user as most recently used"""
+        self.users.move_to_end(user_id)
+        self.last_used[user_id] = time.monotonic()
+
+    def oldest_user(self):
+        """Return (user_id, last_used) of the least recently used user, or None"""
+        for user_id in self.users:
+            return user_id, self.last_used[user_id]
+        return None
+
+    def evict_idle(self, cutoff):
+        """Evict users not used since the monotonic time cutoff; returns the count"""
+        evicted = 0
+        while self.users:
+            user_id, last_used = self.oldest_user()
+            if last_used >= cutoff:
+                break
+            self.unload(user_id)
+            evicted += 1
+        return evicted
+
+    def evict_lru(self, max_users):
+        """Evict least recently used users beyond max_users; returns the count"""
+        evicted = 0
+        while len(self.users) > max_users:
+            self.unload(self.oldest_user()[0])
+            evicted += 1
+        return evicted
+
+    def turns(self, user_id):
+        return self.users.get(user_id, [])
+
+    def fold(self, user_id, folded, summary):
+        """Replace the folded leading turns with a summary.
+
+        Returns False without changing anything if those turns are no longer
+        at the head of the history (it was cleared or trimmed meanwhile).
+        """
+        turns = self.users.get(user_id, [])
+        if len(turns) < len(folded) or any(a is not b for a, b in zip(turns, folded)):
+            return False
+        self.drop(user_id, len(folded))
+        self.summaries[user_id] = summary
+        if self.store:
+            self.store.save_summary(self.name, user_id, summary)
+            self.store.keep_latest(self.name, user_id, len(turns))
+        return True
+
+    def messages(self, user_id, budget=None):
+        """Build the OpenAI message list for a user, optionally within a token budget.
+
+        Over budget, attachments of older turns are stubbed out first, oldest
+        first, then the oldest turns are dropped. The newest turn is always
+        sent in full.
+        """
+        turns = self.users.get(user_id, [])
+        last = len(turns) - 1
+        stubbed = 0
+        start = 0
+        if budget is not None:
+            total = self.tokens.get(user_id, 0)
+            while total > budget and stubbed < last:
+                total -= turns[stubbed].tokens - turns[stubbed].stub_tokens
+                stubbed += 1
+            while total > budget and start < last:
+                total -= turns[start].stub_tokens
+                start += 1
+            # Don't open the window on an assistant reply
+            while start < last and turns[start].role == "assistant":
+                start += 1
+
+        result = []
+        for index in range(start, len(turns)):
+            message = turns[index]
+            if isinstance(message.content, str):
+                content = message.content
+            elif index < stubbed:
+                content = [unpack_part(stub_part(part), self.blobs) for part in message.content]
+            else:
+                content = [unpack_part(part, self.blobs) for part in message.content]
+            result.append({"role": message.role, "content": content})
+        return result
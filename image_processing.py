@@ -0,0 +1,77 @@
+import asyncio
+import base64
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; images are sent unmodified without it
+    Image = None
+
+log = logging.getLogger(__name__)
+
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "1568"))
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "80"))
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "JPEG").upper()
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+
+image_executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="image")
+
+# Image.info keys that can carry camera, location or author details
+METADATA_KEYS = ("exif", "xmp", "XML:com.adobe.xmp", "comment", "photoshop")
+
+def flatten(img):
+    """Drop the alpha channel, compositing onto white (JPEG has no transparency)"""
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel("A"))
+        return background
+    return img.convert("RGB")
+
+def preprocess_image(content, ext):
+    """Downscale, strip metadata and re-encode an image.
+
+    Returns (bytes, ext). The original is kept if Pillow is missing or the
+    image can't be decoded, or if it needed no downscaling, carries no
+    metadata and re-encoding would not make it smaller.
+    """
+    if Image is None:
+        return content, ext
+
+    try:
+        with Image.open(io.BytesIO(content)) as img:
+            has_metadata = (any(key in img.info for key in METADATA_KEYS) or
+                            bool(getattr(img, "text", None)))
+            original_size = img.size
+            # Apply EXIF rotation before the metadata is dropped
+            img = ImageOps.exif_transpose(img)
+            if IMAGE_FORMAT == "JPEG" or img.mode not in ("RGB", "RGBA"):
+                img = flatten(img)
+            img.thumbnail((IMAGE_MAX_EDGE, IMAGE_MAX_EDGE), Image.LANCZOS)
+            downscaled = img.size != original_size
+
+            output = io.BytesIO()
+            img.save(output, format=IMAGE_FORMAT, quality=IMAGE_QUALITY, optimize=True)
+    except Exception as e:
+        log.warning("Error preprocessing image: %s", e)
+        return content, ext
+
+    processed = output.getvalue()
+    if not (downscaled or has_metadata) and len(processed) >= len(content):
+        return content, ext
+    return processed, IMAGE_FORMAT.lower()
+
+def encode_image(content, ext):
+    """Preprocess an image and return it as a base64 data URL"""
+    content, ext = preprocess_image(content, ext)
+    if ext == 'jpg':
+        ext = 'jpeg'
+    return f"data:image/{ext};base64,{base64.b64encode(content).decode('utf-8')}"
+
+async def encode_image_async(content, ext):
+    """Run encode_image in the worker pool so the event loop keeps running"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(image_executor, encode_image, content, ext)
@@ -1,17 +1,67 @@
-from flask import Flask
-from threading import Thread
+import json
+import logging
 
-app = Flask(__name__)
+from aiohttp import web
 
-@app.route('/')
-def home():
-    return 'Bot is alive!', 200
+log = logging.getLogger(__name__)
 
-def run():
-    app.run(host='0.0.0.0', port=8080, debug=False, use_reloader=False)
+class OpsServer:
+    """Keep-alive and ops HTTP endpoints, served on the bot's own event loop.
 
-def start():
-    """Start the Flask server in a background thread"""
-    server = Thread(target=run, daemon=True)
-    server.start()
-    print('✅ Keep-alive server started on port 8080')
+    / and /healthz answer as long as the process is up. /readyz runs
+    ready_check(), which returns (ready, details), and answers 503 when not
+    ready. /metrics serves metrics_text() in Prometheus text format.
+    add_json() registers further endpoints that return a dict as JSON.
+    """
+
+    def __init__(self, host, port, ready_check, metrics_text):
+        self.host = host
+        self.port = port
+        self.ready_check = ready_check
+        self.metrics_text = metrics_text
+        self.runner = None
+
+        self.app = web.Application()
+        self.app.router.add_get('/', self.home)
+        self.app.router.add_get('/healthz', self.healthz)
+        self.app.router.add_get('/readyz', self.readyz)
+        self.app.router.add_get('/metrics', self.metrics)
+
+    async def home(self, request):
+        return web.Response(text='Bot is alive!')
+
+    async def healthz(self, request):
+        return web.Response(text='ok')
+
+    async def readyz(self, request):
+        ready, details = self.ready_check()
+        return web.Response(
+            text=json.dumps({"ready": ready, **details}),
+            status=200 if ready else 503,
+            content_type='application/json'
+        )
+
+    async def metrics(self, request):
+        return web.Response(text=self.metrics_text(), content_type='text/plain', charset='utf-8')
+
+    def add_json(self, path, get_data):
+        async def handler(request):
+            return web.json_response(get_data())
+        self.app.router.add_get(path, handler)
+
+    async def start(self):
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        try:
+            await web.TCPSite(self.runner, self.host, self.port).start()
+        except OSError as e:
+            # E.g. the port is in use; the bot itself can run without these endpoints
+            log.error("Keep-alive server failed to start on port %d: %s", self.port, e)
+            await self.stop()
+            return
+        log.info("Keep-alive server started on port %d", self.port)
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
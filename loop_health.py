@@ -0,0 +1,91 @@
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+STACK_DEPTH = 15  # Innermost frames kept per captured stack
+
+class LoopMonitor:
+    """Event loop health: a lag probe on the loop and a watchdog thread.
+
+    The probe sleeps for interval and records how late it woke up; wake-ups
+    at least block_threshold late count as blocked time. The watchdog runs
+    in its own thread, so it still runs while the loop is stuck. When the
+    probe is overdue by block_threshold it captures the loop thread's
+    stack, which shows the call that is blocking the loop.
+    """
+
+    def __init__(self, interval=0.25, block_threshold=0.25, max_stalls=20):
+        self.interval = interval
+        self.block_threshold = block_threshold
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.last_probe = None
+        self.blocked_seconds = 0.0
+        self.blocked_probes = 0
+        self.stall_count = 0
+        self.stalls = deque(maxlen=max_stalls)
+        self.open_stall = None  # Captured stall whose total lag isn't known yet
+        self.captured_probe = None
+        self.loop_thread_id = None
+
+    async def run(self):
+        self.loop_thread_id = threading.get_ident()
+        self.last_probe = time.monotonic()
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.lag = max(0.0, now - start - self.interval)
+            self.max_lag = max(self.max_lag, self.lag)
+            if self.lag >= self.block_threshold:
+                self.blocked_seconds += self.lag
+                self.blocked_probes += 1
+            stall = self.open_stall
+            if stall is not None:
+                stall["lag_seconds"] = round(self.lag, 3)
+                self.open_stall = None
+            self.last_probe = now
+
+    def _watch(self):
+        while True:
+            time.sleep(self.block_threshold / 2)
+            last_probe = self.last_probe
+            overdue = time.monotonic() - last_probe - self.interval
+            # One capture per stall
+            if overdue < self.block_threshold or self.captured_probe == last_probe:
+                continue
+            frame = sys._current_frames().get(self.loop_thread_id)
+            if frame is None:
+                continue
+            self.captured_probe = last_probe
+            stall = {
+                "at": time.time(),
+                "blocked_for": round(overdue, 3),
+                "lag_seconds": None,
+                "stack": "".join(traceback.format_stack(frame)[-STACK_DEPTH:]),
+            }
+            self.stalls.append(stall)
+            self.stall_count += 1
+            self.open_stall = stall
+
+    def current_lag(self):
+        """Latest lag, or the time since the probe was due if it is overdue (the loop is stuck)"""
+        if self.last_probe is None:
+            return 0.0
+        overdue = time.monotonic() - self.last_probe - self.interval
+        return max(self.lag, overdue)
+
+    def report(self):
+        return {
+            "lag_seconds": round(self.current_lag(), 3),
+            "max_lag_seconds": round(self.max_lag, 3),
+            "blocked_seconds": round(self.blocked_seconds, 3),
+            "blocked_probes": self.blocked_probes,
+            "block_threshold_seconds": self.block_threshold,
+            "stalls": self.stall_count,
+            "recent_stalls": list(self.stalls),
+        }
@@ -1,10 +1,4 @@
 
-import os
-from keep_alive import start as start_keep_alive
-
-if __name__ == '__main__':
-    start_keep_alive()  # Start Flask server FIRST
-
 import discord
 from discord.ext import commands
 from discord import app_commands
@@ -12,33 +6,136 @@ from discord.ui import Button, View
 import openai
 import os
 import aiohttp
-import base64
-from collections import defaultdict
 import json
+import hashlib
+import logging
 from datetime import datetime, timedelta
 import asyncio
+import time
+from image_processing import encode_image_async
+from history import BlobStore, ConversationHistory, estimate_tokens, message_text
+from conversation_store import ConversationStore
+from rate_limiter import GlobalLimiter, RateLimiter
+from persistence import WriteBehindWriter, atomic_write
+from scheduler import FairScheduler, QueueFull
+from resilience import CircuitOpenError, LatencyTracker, ModelGuards
+from response_cache import ResponseCache, SingleFlight, cache_key
+from dispatch import Dispatcher
+from keep_alive import OpsServer
+from loop_health import LoopMonitor
+from metrics import SIZE_BUCKETS, MetricsRegistry
+from tracing import Tracer, current_trace, span
+from structured_logging import setup_logging
+from command_registry import COMMANDS, COMMANDS_BY_NAME, COMMANDS_BY_TYPE, DEFAULT_MENTION_COMMAND, model_concurrency_limits
+
+log = logging.getLogger("mrtutor")
 
 intents = discord.Intents.default()
 intents.message_content = True
 intents.guilds = True
 intents.members = True
 
-bot = commands.Bot(command_prefix="$", intents=intents, help_command=None)
+class TutorBot(commands.Bot):
+    async def setup_hook(self):
+        """One-time startup; on_ready runs again on every gateway reconnect"""
+        load_persistent_data()
+        get_http_session()
+        await ops_server.start()
+        await sync_commands()
+        spawn(check_bot_state_loop())
+        spawn(memory_sweep_loop())
+        spawn(loop_monitor.run())
+
+    async def close(self):
+        await ops_server.stop()
+        await close_http_session()
+        await super().close()
+        state_writer.flush()
+        tracer.flush()
+        conversation_store.close()
+
+bot = TutorBot(command_prefix="$", intents=intents, help_command=None)
 
 POE_API_KEY = os.getenv("POE_API_KEY")
 DISCORD_BOT_TOKEN = os.getenv("DISCORD_BOT_TOKEN")
 ADMIN_IDS = os.getenv("ADMIN_IDS", "").split(",")
 ADMIN_ROLE_NAME = os.getenv("ADMIN_ROLE_NAME", "Admin")
 
+# Poe API client settings
+POE_TIMEOUT = float(os.getenv("POE_TIMEOUT", "1000"))
+POE_MAX_CONCURRENT_REQUESTS = int(os.getenv("POE_MAX_CONCURRENT_REQUESTS", "16"))
+
+# Per-model resilience: concurrency pools, retries and circuit breakers
+MODEL_MAX_CONCURRENCY = int(os.getenv("MODEL_MAX_CONCURRENCY", "8"))
+POE_MAX_RETRIES = int(os.getenv("POE_MAX_RETRIES", "2"))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+
+# Hedged requests: if a model is slower than its recent p95 to start answering,
+# race the command's fallback model and keep whichever answers first
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "8"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "2"))
+HEDGE_MAX_DELAY = float(os.getenv("HEDGE_MAX_DELAY", "30"))
+
+# Response cache for stateless requests (opt-in per command type below)
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL_HOURS", "24")) * 3600
+RESPONSE_CACHE_DIR = os.getenv("RESPONSE_CACHE_DIR", "")
+
+# Request scheduling: one generation in flight per user and history type
+SCHEDULER_WORKERS = int(os.getenv("SCHEDULER_WORKERS", str(POE_MAX_CONCURRENT_REQUESTS)))
+MAX_QUEUED_PER_USER = int(os.getenv("MAX_QUEUED_PER_USER", "3"))
+MAX_QUEUED_TOTAL = int(os.getenv("MAX_QUEUED_TOTAL", "200"))
+
+# Streaming replies: edit the thinking message as tokens arrive
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "true").lower() == "true"
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))
+DISCORD_MESSAGE_LIMIT = 2000
+
+# Attachment downloads share one pooled HTTP session
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "32"))
+ATTACHMENT_MAX_CONCURRENCY = int(os.getenv("ATTACHMENT_MAX_CONCURRENCY", "4"))
+ATTACHMENT_TIMEOUT = float(os.getenv("ATTACHMENT_TIMEOUT", "30"))
+
+# Ops HTTP server (keep-alive pings, health checks and metrics)
+OPS_HOST = os.getenv("OPS_HOST", "0.0.0.0")
+OPS_PORT = int(os.getenv("PORT", "8080"))
+READY_MAX_LOOP_LAG = float(os.getenv("READY_MAX_LOOP_LAG", "1.0"))
+
+# Event loop health: lag probe interval and the stall length that captures a stack
+LOOP_PROBE_INTERVAL = float(os.getenv("LOOP_PROBE_INTERVAL", "0.25"))
+LOOP_BLOCK_THRESHOLD_MS = float(os.getenv("LOOP_BLOCK_THRESHOLD_MS", "250"))
+
+# Logging: JSON records written by a background thread; DEBUG enables per-command detail
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_FILE = os.getenv("LOG_FILE", "")
+LOG_MAX_MB = float(os.getenv("LOG_MAX_MB", "50"))
+
+# Per-request traces: stage timings written to a JSONL file (empty TRACE_FILE disables)
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.05"))
+TRACE_SLOW_SECONDS = float(os.getenv("TRACE_SLOW_SECONDS", "15"))
+TRACE_MAX_MB = float(os.getenv("TRACE_MAX_MB", "50"))
+
 # Persistent storage files
 RATE_LIMITS_FILE = "rate_limits.json"
 BOT_STATE_FILE = "bot_state.json"
 USER_ACCEPTANCES_FILE = "user_acceptances.json"
+COMMAND_TREE_HASH_FILE = "command_tree.hash"
+CONVERSATION_DB_FILE = os.getenv("CONVERSATION_DB_FILE", "conversations.db")
+SAVE_DELAY = float(os.getenv("SAVE_DELAY", "2"))
 
-# Separate conversation histories for tutor vs non-tutor models
-tutor_conversation_history = defaultdict(list)
-standard_conversation_history = defaultdict(list)
+# Separate conversation histories for tutor vs non-tutor models.
+# Images and large files are stored once in the shared blob store, and every
+# turn is persisted to SQLite so histories survive restarts.
 MAX_HISTORY_LENGTH = 50
+blob_store = BlobStore()
+conversation_store = ConversationStore(CONVERSATION_DB_FILE)
+tutor_conversation_history = ConversationHistory(blob_store, MAX_HISTORY_LENGTH,
+                                                 conversation_store, "tutor")
+standard_conversation_history = ConversationHistory(blob_store, MAX_HISTORY_LENGTH,
+                                                    conversation_store, "standard")
 
 rate_limits = {
     "global": {},
@@ -50,7 +147,22 @@ bot_state = {
     "disable_until": None
 }
 
-user_messages = defaultdict(lambda: defaultdict(list))
+# Per-user limits reject; global limits are shared by everyone and queue instead
+rate_limiter = RateLimiter()
+global_limiter = GlobalLimiter()
+GLOBAL_LIMIT_MAX_WAIT = float(os.getenv("GLOBAL_LIMIT_MAX_WAIT", "120"))
+
+# Eviction of idle per-user state, checked every MEMORY_SWEEP_INTERVAL seconds
+HISTORY_IDLE_TTL = float(os.getenv("HISTORY_IDLE_TTL_HOURS", "6")) * 3600
+HISTORY_MAX_USERS = int(os.getenv("HISTORY_MAX_USERS", "5000"))
+HISTORY_MAX_BYTES = int(float(os.getenv("HISTORY_MAX_MB", "256")) * 1024 * 1024)
+MEMORY_SWEEP_INTERVAL = 60
+eviction_stats = {
+    "idle": 0,
+    "lru": 0,
+    "memory": 0,
+    "rate_limit_users": 0
+}
 user_acceptances = {}
 
 custom_prompt = """# Mr. Tutor – Core Guidelines
@@ -117,48 +229,91 @@ By following these guidelines, Mr. Tutor ensures that learners:
     
 ---
 """
+CUSTOM_PROMPT_TOKENS = estimate_tokens(custom_prompt)
 
-poe_client = openai.OpenAI(
+# Shared async client: one connection pool for every request, never blocks the event loop
+poe_client = openai.AsyncOpenAI(
     api_key=POE_API_KEY,
     base_url="https://api.poe.com/v1",
+    timeout=POE_TIMEOUT,
+    max_retries=0,  # Retries are handled per model by model_guards
+)
+
+# Caps in-flight Poe requests; created lazily so it binds to the running loop
+poe_semaphore = None
+
+def get_poe_semaphore():
+    global poe_semaphore
+    if poe_semaphore is None:
+        poe_semaphore = asyncio.Semaphore(POE_MAX_CONCURRENT_REQUESTS)
+    return poe_semaphore
+
+# Prompt token budget for commands that don't set their own
+DEFAULT_CONTEXT_BUDGET = 32000
+
+response_cache = ResponseCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, RESPONSE_CACHE_DIR or None)
+# Identical stateless requests in flight at the same time share one upstream call
+inflight_requests = SingleFlight()
+
+latency_tracker = LatencyTracker(HEDGE_DEFAULT_DELAY, HEDGE_MIN_DELAY, HEDGE_MAX_DELAY)
+
+model_guards = ModelGuards(
+    MODEL_MAX_CONCURRENCY,
+    model_concurrency_limits(),
+    retries=POE_MAX_RETRIES,
+    failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+    reset_timeout=CIRCUIT_RESET_SECONDS
 )
 
-# Command configurations - LONGER PREFIXES FIRST
-COMMAND_CONFIGS = [
-    # $ prefix versions (longer first)
-    ("tutorplus", "Gemini-2.5-Flash-Tut", True, "plus"),
-    ("tutorminus", "Gemini-2.5-Flash-Lite", True, "minus"),
-    ("imageplus", "GPT-Image-1-Mini", False, "imageplus"),
-    ("standardplus", "Gemini-2.5-Flash-Tut", False, "nonplus"),
-    ("standardminus", "Gemini-2.5-Flash-Lite", False, "nonminus"),
-    ("tutor", "tester-kimi-k2-non", True, "normal"),
-    ("image", "FLUX-schnell", False, "image"),
-    ("standard", "tester-kimi-k2-non", False, "nonnormal"),
-    # Keep old $ shortcuts for backwards compatibility
-    ("tut+", "Gemini-2.5-Flash-Tut", True, "plus"),
-    ("tut-", "Gemini-2.5-Flash-Lite", True, "minus"),
-    ("tut", "tester-kimi-k2-non", True, "normal"),
-    ("ti+", "GPT-Image-1-Mini", False, "imageplus"),
-    ("ti", "FLUX-schnell", False, "image"),
-    ("tn+", "Gemini-2.5-Flash-Tut", False, "nonplus"),
-    ("tn-", "Gemini-2.5-Flash-Lite", False, "nonminus"),
-    ("tn", "tester-kimi-k2-non", False, "nonnormal"),
-    ("t+", "Gemini-2.5-Flash-Tut", True, "plus"),
-    ("t-", "Gemini-2.5-Flash-Lite", True, "minus"),
-    ("t", "tester-kimi-k2-non", True, "normal"),
-]
+tracer = Tracer(TRACE_FILE or None, TRACE_SAMPLE_RATE, TRACE_SLOW_SECONDS, int(TRACE_MAX_MB * 1024 * 1024))
+
+# Request pipeline metrics, served at /metrics on the keep-alive port
+metrics = MetricsRegistry(prefix="mrtutor_")
+attachment_download_seconds = metrics.histogram(
+    "attachment_download_seconds", "Time to download one attachment")
+attachment_download_bytes = metrics.histogram(
+    "attachment_download_bytes", "Size of downloaded attachments", buckets=SIZE_BUCKETS)
+attachment_download_failures = metrics.counter(
+    "attachment_download_failures_total", "Attachments that failed to download")
+poe_request_seconds = metrics.histogram(
+    "poe_request_seconds", "Poe request latency including retries", labels=("model",))
+poe_requests = metrics.counter(
+    "poe_requests_total", "Poe requests by outcome", labels=("model", "outcome"))
+command_seconds = metrics.histogram(
+    "command_seconds", "Command latency from queueing to final reply", labels=("command_type",))
+rate_limit_rejections = metrics.counter(
+    "rate_limit_rejections_total", "Commands rejected by a rate limit or full queue",
+    labels=("command_type", "scope"))
+acceptance_prompts = metrics.counter(
+    "acceptance_prompts_total", "Non-tutor agreement prompts shown", labels=("command_type",))
+
+# Long tutor sessions are folded into a running summary in the background
+SUMMARY_MODEL = "Gemini-2.5-Flash-Lite"
+SUMMARY_TRIGGER_TURNS = int(os.getenv("SUMMARY_TRIGGER_TURNS", "30"))
+SUMMARY_TRIGGER_TOKENS = int(os.getenv("SUMMARY_TRIGGER_TOKENS", "16000"))
+SUMMARY_KEEP_TURNS = int(os.getenv("SUMMARY_KEEP_TURNS", "10"))
+SUMMARY_MIN_FOLD_TOKENS = int(os.getenv("SUMMARY_MIN_FOLD_TOKENS", "4000"))
+SUMMARY_PROMPT = """You maintain the running summary of a tutoring session between a learner and Mr. Tutor.
+You are given the existing summary (if any) and the next part of the conversation.
+Return an updated summary that keeps the problem being worked on, the steps the learner has completed,
+hints already given, misconceptions, and where the session left off. Be concise. Return only the summary."""
 
 # Helper functions
 def load_json(filename, default):
     try:
         with open(filename, 'r') as f:
             return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
+    except FileNotFoundError:
+        return default
+    except json.JSONDecodeError as e:
+        log.warning("Could not parse %s, using defaults: %s", filename, e)
         return default
 
-def save_json(filename, data):
-    with open(filename, 'w') as f:
-        json.dump(data, f, indent=2)
+# Saves are coalesced and written atomically in the background
+state_writer = WriteBehindWriter(SAVE_DELAY)
+state_writer.register(RATE_LIMITS_FILE, lambda: rate_limits)
+state_writer.register(BOT_STATE_FILE, lambda: bot_state)
+state_writer.register(USER_ACCEPTANCES_FILE, lambda: user_acceptances)
 
 def load_persistent_data():
     global rate_limits, bot_state, user_acceptances
@@ -167,13 +322,13 @@ def load_persistent_data():
     user_acceptances = load_json(USER_ACCEPTANCES_FILE, {})
 
 def save_rate_limits():
-    save_json(RATE_LIMITS_FILE, rate_limits)
+    state_writer.mark_dirty(RATE_LIMITS_FILE)
 
 def save_bot_state():
-    save_json(BOT_STATE_FILE, bot_state)
+    state_writer.mark_dirty(BOT_STATE_FILE)
 
 def save_user_acceptances():
-    save_json(USER_ACCEPTANCES_FILE, user_acceptances)
+    state_writer.mark_dirty(USER_ACCEPTANCES_FILE)
 
 def is_admin(user_id, member=None):
     """Check if user is admin by ID or role"""
@@ -200,12 +355,6 @@ def check_rate_limit(user_id, command):
     """Check if user has exceeded rate limits for a command"""
     now = datetime.now().timestamp()
 
-    if user_id in user_messages and command in user_messages[user_id]:
-        user_messages[user_id][command] = [
-            ts for ts in user_messages[user_id][command]
-            if now - ts < 3600
-        ]
-
     user_id_str = str(user_id)
     if user_id_str in rate_limits["users"] and command in rate_limits["users"][user_id_str]:
         limit_config = rate_limits["users"][user_id_str][command]
@@ -214,47 +363,27 @@ def check_rate_limit(user_id, command):
             del rate_limits["users"][user_id_str][command]
             save_rate_limits()
         else:
-            timestamps = user_messages[user_id][command]
-
-            if "per_minute" in limit_config:
-                recent_1min = [ts for ts in timestamps if now - ts < 60]
-                if len(recent_1min) >= limit_config["per_minute"]:
-                    return False, "You've exceeded the rate limit (per minute) for this command."
-
-            if "per_10min" in limit_config:
-                recent_10min = [ts for ts in timestamps if now - ts < 600]
-                if len(recent_10min) >= limit_config["per_10min"]:
-                    return False, "You've exceeded the rate limit (per 10 minutes) for this command."
+            window = rate_limiter.exceeded(user_id, command, limit_config, now)
+            if window:
+                return False, f"You've exceeded the rate limit ({window}) for this command."
 
-            if "per_hour" in limit_config:
-                recent_hour = [ts for ts in timestamps if now - ts < 3600]
-                if len(recent_hour) >= limit_config["per_hour"]:
-                    return False, "You've exceeded the rate limit (per hour) for this command."
-
-    if command in rate_limits["global"]:
-        limit_config = rate_limits["global"][command]
-        timestamps = user_messages[user_id][command]
-
-        if "per_minute" in limit_config:
-            recent_1min = [ts for ts in timestamps if now - ts < 60]
-            if len(recent_1min) >= limit_config["per_minute"]:
-                return False, "Global rate limit exceeded (per minute) for this command."
-
-        if "per_10min" in limit_config:
-            recent_10min = [ts for ts in timestamps if now - ts < 600]
-            if len(recent_10min) >= limit_config["per_10min"]:
-                return False, "Global rate limit exceeded (per 10 minutes) for this command."
+    return True, None
 
-        if "per_hour" in limit_config:
-            recent_hour = [ts for ts in timestamps if now - ts < 3600]
-            if len(recent_hour) >= limit_config["per_hour"]:
-                return False, "Global rate limit exceeded (per hour) for this command."
+def acquire_global_capacity(command_type, model):
+    """Take server-wide capacity for a command type and model.
 
-    return True, None
+    Keys of rate_limits["global"] may name either. Returns 0 if admitted,
+    otherwise the seconds until there is room (inf if never).
+    """
+    limits = [(key, rate_limits["global"][key]) for key in (command_type, model)
+              if key in rate_limits["global"]]
+    if not limits:
+        return 0
+    return global_limiter.try_acquire(limits, time.time())
 
 def record_message(user_id, command):
     """Record a message for rate limiting"""
-    user_messages[user_id][command].append(datetime.now().timestamp())
+    rate_limiter.record(user_id, command, datetime.now().timestamp())
 
 def needs_acceptance(user_id):
     """Check if user needs to accept terms for non-teach models"""
@@ -301,16 +430,58 @@ class AcceptanceView(View):
                                                 ephemeral=True)
         self.stop()
 
+http_session = None
+
+def get_http_session():
+    """Return the shared HTTP session, creating it on first use"""
+    global http_session
+    if http_session is None or http_session.closed:
+        connector = aiohttp.TCPConnector(limit=HTTP_POOL_SIZE, ttl_dns_cache=300)
+        http_session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=ATTACHMENT_TIMEOUT)
+        )
+    return http_session
+
+async def close_http_session():
+    global http_session
+    if http_session is not None and not http_session.closed:
+        await http_session.close()
+    http_session = None
+
 async def download_attachment(attachment):
+    start = time.monotonic()
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(attachment.url) as resp:
-                if resp.status == 200:
-                    return await resp.read()
+        async with get_http_session().get(attachment.url) as resp:
+            if resp.status == 200:
+                content = await resp.read()
+                attachment_download_seconds.observe(time.monotonic() - start)
+                attachment_download_bytes.observe(len(content))
+                return content
     except Exception as e:
-        print(f"Error downloading attachment: {e}")
+        log.warning("Error downloading attachment: %s", e)
+    attachment_download_failures.inc()
     return None
 
+async def download_attachments(attachments):
+    """Download attachments concurrently; returns contents in order, None for failures"""
+    if not attachments:
+        return []
+
+    semaphore = asyncio.Semaphore(ATTACHMENT_MAX_CONCURRENCY)
+
+    async def limited_download(attachment):
+        async with semaphore:
+            return await download_attachment(attachment)
+
+    tasks = [asyncio.ensure_future(limited_download(a)) for a in attachments]
+    done, pending = await asyncio.wait(tasks, timeout=ATTACHMENT_TIMEOUT)
+    for task in pending:
+        task.cancel()
+    if pending:
+        log.warning("Timed out downloading %d attachment(s)", len(pending))
+    return [task.result() if task in done else None for task in tasks]
+
 def is_image(filename):
     image_extensions = ['.png', '.jpg', '.jpeg', '.gif', '.webp', '.bmp']
     return any(filename.lower().endswith(ext) for ext in image_extensions)
@@ -321,19 +492,19 @@ def is_text_file(filename):
 
 async def process_attachments(attachments):
     attachment_contents = []
-    for attachment in attachments:
-        content = await download_attachment(attachment)
+    with span("download_attachments"):
+        downloads = await download_attachments(attachments)
+    for attachment, content in zip(attachments, downloads):
         if not content:
             continue
         if is_image(attachment.filename):
-            base64_image = base64.b64encode(content).decode('utf-8')
             ext = attachment.filename.lower().split('.')[-1]
-            if ext == 'jpg':
-                ext = 'jpeg'
+            with span("encode_image"):
+                url = await encode_image_async(content, ext)
             attachment_contents.append({
                 "type": "image_url",
                 "image_url": {
-                    "url": f"data:image/{ext};base64,{base64_image}"
+                    "url": url
                 }
             })
         elif is_text_file(attachment.filename):
@@ -355,10 +526,21 @@ async def process_attachments(attachments):
             })
     return attachment_contents
 
-def query_poe(user_id, user_prompt, attachment_contents=None, model="tester-kimi-k2-non", use_tutor_prompt=True):
+async def query_poe(user_id, user_prompt, attachment_contents=None, model="tester-kimi-k2-non", use_tutor_prompt=True, on_delta=None, fallback_model=None, use_cache=False, budget=None):
+    """Query Poe with the user's history; streams text deltas to on_delta when given.
+
+    The prompt is windowed to budget tokens (DEFAULT_CONTEXT_BUDGET if None).
+
+    With a fallback_model, a slow start is hedged by racing the fallback.
+    A first turn (no earlier history) is stateless: identical ones in
+    flight share one upstream call, and with use_cache it may be answered
+    from the response cache.
+    """
     try:
         # Use appropriate conversation history
         conversation_history = tutor_conversation_history if use_tutor_prompt else standard_conversation_history
+        with span("load_history"):
+            await conversation_history.load(user_id)
         
         if attachment_contents:
             message_content = [{"type": "text", "text": user_prompt}]
@@ -366,72 +548,290 @@ def query_poe(user_id, user_prompt, attachment_contents=None, model="tester-kimi
         else:
             message_content = user_prompt
 
-        conversation_history[user_id].append({
-            "role": "user",
-            "content": message_content
-        })
-
-        if len(conversation_history[user_id]) > MAX_HISTORY_LENGTH:
-            conversation_history[user_id] = conversation_history[user_id][-MAX_HISTORY_LENGTH:]
+        conversation_history.append(user_id, "user", message_content)
 
+        if budget is None:
+            budget = DEFAULT_CONTEXT_BUDGET
         messages = []
         if use_tutor_prompt:
-            messages.append({"role": "system", "content": custom_prompt})
-        messages.extend(conversation_history[user_id])
-
-        print(f"[DEBUG] Querying Poe with model: {model}, use_tutor: {use_tutor_prompt}")
-
-        chat = poe_client.chat.completions.create(
-            model=model,
-            messages=messages,
-            timeout=1000
-        )
-        response_content = chat.choices[0].message.content
-        conversation_history[user_id].append({
-            "role": "assistant",
-            "content": response_content
-        })
+            system_prompt = custom_prompt
+            budget -= CUSTOM_PROMPT_TOKENS
+            summary = conversation_history.summaries.get(user_id)
+            if summary:
+                system_prompt += f"\n\n## Summary of the earlier conversation\n{summary}"
+                budget -= estimate_tokens(summary)
+            messages.append({"role": "system", "content": system_prompt})
+        messages.extend(conversation_history.messages(user_id, budget))
+
+        key = None
+        if (len(conversation_history.turns(user_id)) == 1 and
+                user_id not in conversation_history.summaries):
+            key = cache_key(model, messages)
+            cached = await response_cache.get(key) if use_cache else None
+            if cached is not None:
+                if on_delta:
+                    await on_delta(cached)
+                conversation_history.append(user_id, "assistant", cached)
+                return cached
+
+        log.debug("Querying Poe with model: %s, use_tutor: %s", model, use_tutor_prompt)
+
+        async def complete():
+            if fallback_model and fallback_model != model:
+                return await hedged_completion(model, fallback_model, messages, on_delta)
+            return model, await poe_completion(model, messages, on_delta)
+
+        with span("poe"):
+            if key:
+                (answered_by, response_content), shared = await inflight_requests.do(key, complete)
+                if shared and on_delta:
+                    await on_delta(response_content)
+                if use_cache and not shared and response_content:
+                    # Cached under the model that answered, which a hedge may have switched
+                    await response_cache.put(cache_key(answered_by, messages), response_content)
+            else:
+                _, response_content = await complete()
+        conversation_history.append(user_id, "assistant", response_content)
+        if use_tutor_prompt:
+            schedule_compaction(user_id)
         return response_content
-    except openai.APIError as e:
-        return f"API Error: {e}"
+    except CircuitOpenError as e:
+        return f"⚠️ {e}"
     except openai.APIConnectionError as e:
         return f"Connection Error: Failed to connect to Poe API - {e}"
     except openai.RateLimitError as e:
         return f"Rate Limit Error: {e}"
     except openai.AuthenticationError as e:
         return f"Authentication Error: Invalid API key - {e}"
+    except openai.APIError as e:
+        return f"API Error: {e}"
     except Exception as e:
         return f"Unexpected error: {e}"
 
-async def generate_image(prompt, model="FLUX-schnell"):
-    """Generate image using Poe API"""
+async def poe_completion(model, messages, on_delta=None, **kwargs):
+    """Run a chat completion through the model's guard and return its text.
+
+    Streams text deltas to on_delta when given; a stream that has already
+    produced output is not retried.
+    """
+    started = False
+
+    async def attempt():
+        nonlocal started
+        async with get_poe_semaphore():
+            start = time.monotonic()
+            if not on_delta:
+                chat = await poe_client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    **kwargs
+                )
+                latency_tracker.record(model, time.monotonic() - start)
+                return chat.choices[0].message.content
+
+            stream = await poe_client.chat.completions.create(
+                model=model,
+                messages=messages,
+                stream=True,
+                **kwargs
+            )
+            parts = []
+            try:
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        if not started:
+                            started = True
+                            latency_tracker.record(model, time.monotonic() - start)
+                        parts.append(delta)
+                        await on_delta(delta)
+            finally:
+                await stream.close()
+            return "".join(parts)
+
+    start = time.monotonic()
+    outcome = "error"
     try:
-        print(f"[DEBUG] Generating image with model: {model}")
-        
-        # Use low quality for GPT-Image-1-Mini
-        extra_body = {}
-        if model == "GPT-Image-1-Mini":
-            extra_body = {"quality": "low"}
-        
-        chat = poe_client.chat.completions.create(
-            model=model,
-            messages=[{"role": "user", "content": prompt}],
-            timeout=1000,
-            extra_body=extra_body
+        result = await model_guards.call(model, attempt, retryable=lambda e: not started)
+        outcome = "ok"
+        return result
+    except CircuitOpenError:
+        outcome = "circuit_open"
+        raise
+    except asyncio.CancelledError:
+        # Lost a hedging race or the caller went away; not a latency sample
+        outcome = "cancelled"
+        raise
+    finally:
+        if outcome != "cancelled":
+            poe_request_seconds.observe(time.monotonic() - start, model)
+        poe_requests.inc(model, outcome)
+
+async def hedged_completion(model, fallback_model, messages, on_delta=None):
+    """Run a completion on model, racing fallback_model if it is slow to start.
+
+    If model hasn't produced output within its adaptive deadline (or fails
+    before then), the same request goes to fallback_model. Whichever
+    produces output first wins; only its deltas reach on_delta and the
+    other request is cancelled. Returns (model that answered, text).
+    """
+    winner = None
+    winner_chosen = asyncio.Event()
+    output_started = {model: asyncio.Event(), fallback_model: asyncio.Event()}
+
+    def sink_for(name):
+        async def sink(delta):
+            nonlocal winner
+            if winner is None:
+                winner = name
+                winner_chosen.set()
+            output_started[name].set()
+            if winner == name and on_delta:
+                await on_delta(delta)
+        return sink
+
+    def cancel_others():
+        for name, task in tasks.items():
+            if name != winner:
+                task.cancel()
+
+    tasks = {model: asyncio.ensure_future(poe_completion(model, messages, sink_for(model)))}
+    started = asyncio.ensure_future(output_started[model].wait())
+    done, _ = await asyncio.wait({tasks[model], started}, timeout=latency_tracker.deadline(model),
+                                 return_when=asyncio.FIRST_COMPLETED)
+    started.cancel()
+    primary_failed = tasks[model] in done and tasks[model].exception() is not None
+    if done and not primary_failed:
+        return model, await tasks[model]
+
+    if primary_failed:
+        log.debug("%s failed, falling back to %s", model, fallback_model)
+        del tasks[model]
+    else:
+        log.debug("%s slow to start, hedging with %s", model, fallback_model)
+    tasks[fallback_model] = asyncio.ensure_future(poe_completion(fallback_model, messages, sink_for(fallback_model)))
+
+    error = None
+    try:
+        while winner is None:
+            waiter = asyncio.ensure_future(winner_chosen.wait())
+            done, _ = await asyncio.wait(set(tasks.values()) | {waiter}, return_when=asyncio.FIRST_COMPLETED)
+            waiter.cancel()
+            if winner is not None:
+                break
+            # A request finished without streaming: success wins, failure drops out
+            for name, task in list(tasks.items()):
+                if task in done:
+                    if task.exception() is None:
+                        winner = name
+                        break
+                    error = task.exception()
+                    del tasks[name]
+            if winner is None and not tasks:
+                raise error
+        # Free the loser's model and Poe slots now, not once the winner has streamed
+        cancel_others()
+        return winner, await tasks[winner]
+    finally:
+        cancel_others()
+
+background_tasks = set()
+compacting_users = set()
+
+def spawn(coro):
+    """Run a coroutine in the background, keeping a reference until it finishes"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+def schedule_compaction(user_id):
+    """Start compacting a user's tutor history once it crosses the threshold"""
+    if user_id in compacting_users:
+        return
+    turns = tutor_conversation_history.turns(user_id)
+    folded = turns_to_fold(turns)
+    if not folded:
+        return
+    # The size trigger counts what compaction would fold: a large turn still in
+    # the kept window would otherwise set off a summary after every reply
+    if (len(turns) >= SUMMARY_TRIGGER_TURNS or
+            (tutor_conversation_history.tokens.get(user_id, 0) >= SUMMARY_TRIGGER_TOKENS and
+             sum(m.tokens for m in folded) >= SUMMARY_MIN_FOLD_TOKENS)):
+        compacting_users.add(user_id)
+        spawn(compact_history(user_id))
+
+def turns_to_fold(turns):
+    """All but the newest SUMMARY_KEEP_TURNS, so the kept window starts on a learner turn"""
+    count = max(len(turns) - SUMMARY_KEEP_TURNS, 0)
+    if not count:
+        return []
+    while count < len(turns) and turns[count].role == "assistant":
+        count += 1
+    return turns[:count]
+
+async def compact_history(user_id):
+    """Fold older tutor turns into the user's running summary"""
+    try:
+        folded = turns_to_fold(tutor_conversation_history.turns(user_id))
+        if not folded:
+            return
+
+        transcript = "\n\n".join(
+            f"{'Learner' if m.role == 'user' else 'Mr. Tutor'}: {message_text(m)}" for m in folded
         )
+        previous = tutor_conversation_history.summaries.get(user_id)
+        prompt = f"Existing summary:\n{previous or '(none)'}\n\nConversation to add:\n{transcript}"
+
+        summary = await poe_completion(SUMMARY_MODEL, [
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": prompt}
+        ])
+        if summary and tutor_conversation_history.fold(user_id, folded, summary):
+            log.debug("Compacted %d tutor turns for user %s", len(folded), user_id)
+    except Exception as e:
+        log.error("Error compacting history for user %s: %s", user_id, e)
+    finally:
+        compacting_users.discard(user_id)
+
+async def generate_image(prompt, model="FLUX-schnell", use_cache=False, options=None):
+    """Generate image using Poe API; returns (content, error message).
 
-        response = chat.choices[0].message
-        return response
+    options are extra request parameters, e.g. {"quality": "low"}.
+    """
+    try:
+        log.debug("Generating image with model: %s", model)
+
+        extra_body = options or {}
+        messages = [{"role": "user", "content": prompt}]
+        key = cache_key(model, messages, **extra_body)
+        if use_cache:
+            cached = await response_cache.get(key)
+            if cached is not None:
+                return cached, None
+
+        with span("poe"):
+            content, shared = await inflight_requests.do(
+                key, lambda: poe_completion(model, messages, extra_body=extra_body)
+            )
+        if use_cache and not shared and content:
+            await response_cache.put(key, content)
+        return content, None
+    except CircuitOpenError as e:
+        return None, f"⚠️ {e}"
     except Exception as e:
-        return f"Image generation error: {e}"
+        return None, f"Image generation error: {e}"
 
 async def process_command_logic(channel, user, message_content, attachments, model, use_tutor, command_type, user_query, is_image_gen, thinking_msg=None):
     """Shared logic for processing commands from both slash and prefix commands"""
-    print(f"[DEBUG] Processing command - Model: {model}, Type: {command_type}, Image: {is_image_gen}")
+    log.debug("Processing command - Model: %s, Type: %s, Image: %s", model, command_type, is_image_gen)
 
     # Check rate limits
     can_proceed, rate_limit_msg = check_rate_limit(user.id, command_type)
     if not can_proceed:
+        rate_limit_rejections.inc(command_type, "user")
         if thinking_msg:
             await thinking_msg.edit(content=f"⏱️ {rate_limit_msg}")
         else:
@@ -456,9 +856,16 @@ async def process_command_logic(channel, user, message_content, attachments, mod
         )
 
         async def process_after_acceptance():
-            await execute_command(channel, user, attachments, model, use_tutor, command_type, user_query, is_image_gen, thinking_msg)
+            # The thinking message was replaced by the agreement prompt
+            trace = tracer.start("command", source="acceptance", user_id=user.id,
+                                 command_type=command_type, model=model)
+            try:
+                await schedule_command(channel, user, attachments, model, use_tutor, command_type, user_query, is_image_gen)
+            finally:
+                tracer.release(trace)
 
         view = AcceptanceView(user.id, process_after_acceptance)
+        acceptance_prompts.inc(command_type)
         
         if thinking_msg:
             await thinking_msg.delete()
@@ -466,16 +873,147 @@ async def process_command_logic(channel, user, message_content, attachments, mod
         await channel.send(embed=acceptance_embed, view=view)
         return
 
-    await execute_command(channel, user, attachments, model, use_tutor, command_type, user_query, is_image_gen, thinking_msg)
+    await schedule_command(channel, user, attachments, model, use_tutor, command_type, user_query, is_image_gen, thinking_msg)
+
+command_scheduler = FairScheduler(SCHEDULER_WORKERS, MAX_QUEUED_PER_USER, MAX_QUEUED_TOTAL)
+
+async def schedule_command(channel, user, attachments, model, use_tutor, command_type, user_query, is_image_gen, thinking_msg=None):
+    """Queue execute_command fairly behind the user's in-flight request"""
+    # The acceptance prompt may have waited on the user since the last check
+    can_proceed, rate_limit_msg = check_rate_limit(user.id, command_type)
+    if not can_proceed:
+        rate_limit_rejections.inc(command_type, "user")
+        if thinking_msg:
+            await thinking_msg.edit(content=f"⏱️ {rate_limit_msg}")
+        else:
+            await channel.send(f"⏱️ {rate_limit_msg}")
+        return
+
+    key = (user.id, "image" if is_image_gen else "tutor" if use_tutor else "standard")
+    state = {"thinking_msg": thinking_msg, "started": False, "rejection": None, "held": False}
+    queued_at = time.monotonic()
+
+    def admit():
+        # Runs when the job is next to start. The limits are checked again
+        # and recorded with nothing awaited in between, so a queued burst
+        # can't all pass, and rejected commands use up no quota or capacity
+        can_proceed, rate_limit_msg = check_rate_limit(user.id, command_type)
+        if not can_proceed:
+            state["rejection"] = ("user", f"⏱️ {rate_limit_msg}")
+            return 0
+        wait = acquire_global_capacity(command_type, model)
+        if wait > 0:
+            if time.monotonic() + wait - queued_at <= GLOBAL_LIMIT_MAX_WAIT:
+                state["held"] = True
+                return wait
+            state["rejection"] = ("global", "⏱️ Global rate limit exceeded for this command. Please try again later.")
+            return 0
+        record_message(user.id, command_type)
+        return 0
+
+    # The job runs in a scheduler task that didn't inherit this context
+    trace = current_trace.get()
+    if trace is not None:
+        trace.hold()
+
+    async def job():
+        state["started"] = True
+        if trace is not None:
+            current_trace.set(trace)
+            trace.add_span("queue", queued_at, time.monotonic())
+        try:
+            if state["rejection"]:
+                scope, msg = state["rejection"]
+                rate_limit_rejections.inc(command_type, scope)
+                if state["thinking_msg"]:
+                    await state["thinking_msg"].edit(content=msg)
+                else:
+                    await channel.send(msg)
+                return
+            await execute_command(channel, user, attachments, model, use_tutor, command_type, user_query, is_image_gen, state["thinking_msg"])
+        finally:
+            command_seconds.observe(time.monotonic() - queued_at, command_type)
+            if trace is not None:
+                tracer.release(trace)
+
+    try:
+        position = command_scheduler.submit(key, job, admit)
+    except QueueFull as e:
+        rate_limit_rejections.inc(command_type, "queue")
+        if trace is not None:
+            tracer.release(trace)
+        if e.scope == "user":
+            msg = "🚦 You already have requests waiting. Please wait for them to finish."
+        else:
+            msg = "🚦 The bot is very busy right now. Please try again in a minute."
+        if thinking_msg:
+            await thinking_msg.edit(content=msg)
+        else:
+            await channel.send(msg)
+        return
+
+    if position:
+        if state["held"]:
+            msg = "⏳ Lots of people are asking right now - your request is queued..."
+        else:
+            msg = f"⏳ Queued ({position} waiting to start)..."
+        if thinking_msg:
+            await thinking_msg.edit(content=msg)
+        else:
+            queued_msg = await channel.send(msg)
+            if state["started"]:
+                await queued_msg.delete()
+            else:
+                state["thinking_msg"] = queued_msg
+
+class StreamingReply:
+    """Streams a reply into Discord messages, coalescing edits to stay under rate limits"""
+
+    def __init__(self, channel, message, interval=STREAM_EDIT_INTERVAL):
+        self.channel = channel
+        self.message = message
+        self.interval = interval
+        self.text = ""  # Text shown in the current message
+        self.streamed = ""  # Everything received so far
+        self.last_edit = 0.0
+
+    async def _edit(self, content):
+        try:
+            await self.message.edit(content=content)
+        except discord.NotFound:
+            self.message = await self.channel.send(content)
+        self.last_edit = time.monotonic()
+
+    async def feed(self, delta):
+        self.streamed += delta
+        self.text += delta
+
+        # Roll over to a new message once the current one is full
+        while len(self.text) > DISCORD_MESSAGE_LIMIT:
+            await self._edit(self.text[:DISCORD_MESSAGE_LIMIT])
+            self.text = self.text[DISCORD_MESSAGE_LIMIT:]
+            self.message = await self.channel.send(self.text[:DISCORD_MESSAGE_LIMIT])
+
+        if time.monotonic() - self.last_edit >= self.interval:
+            await self._edit(self.text)
+
+    async def finish(self, reply):
+        """Flush the final text; reply is the full response or an error string"""
+        if not self.streamed:
+            await self.feed(reply)
+        elif reply != self.streamed:
+            await self.feed(f"\n\n{reply}")
+        await self._edit(self.text or "(No response)")
 
 async def execute_command(channel, user, attachments, model, use_tutor, command_type, user_query, is_image_gen, thinking_msg=None):
     """Execute the actual command"""
-    record_message(user.id, command_type)
+    spec = COMMANDS_BY_TYPE[command_type]
 
     # Handle attachments
     attachment_contents = []
     if attachments and not is_image_gen:
-        attachment_contents = await process_attachments(attachments)
+        with span("attachments"):
+            attachment_contents = await process_attachments(attachments)
 
     if not user_query and not attachment_contents:
         msg = "Please provide a message or attach a file after your command."
@@ -490,21 +1028,22 @@ async def execute_command(channel, user, attachments, model, use_tutor, command_
 
     # Image generation
     if is_image_gen:
-        if not thinking_msg:
-            thinking_msg = await channel.send(f"🎨 Generating image... (using {model})")
-        else:
-            await thinking_msg.edit(content=f"🎨 Generating image... (using {model})")
-
-        try:
-            response = await generate_image(user_query, model)
-            await thinking_msg.delete()
-
-            if isinstance(response, str):
-                await channel.send(response)
+        with span("discord_status"):
+            if not thinking_msg:
+                thinking_msg = await channel.send(f"🎨 Generating image... (using {model})")
             else:
-                content = response.content if hasattr(response, 'content') else str(response)
+                await thinking_msg.edit(content=f"🎨 Generating image... (using {model})")
 
-                if content:
+        try:
+            with span("generate_image"):
+                content, error = await generate_image(user_query, model, use_cache=spec.cacheable,
+                                                      options=spec.options)
+            with span("discord_reply"):
+                await thinking_msg.delete()
+
+                if error:
+                    await channel.send(error)
+                elif content:
                     await channel.send(f"**Prompt:** {user_query}\n\n{content}")
                 else:
                     await channel.send(f"Image generated for: {user_query}")
@@ -516,39 +1055,150 @@ async def execute_command(channel, user, attachments, model, use_tutor, command_
     # Text generation
     model_emoji = "🤖" if not use_tutor else "📚"
     status_msg = f"{model_emoji} {'Mr. Tutor' if use_tutor else 'AI'} is thinking... (using {model})"
-    
-    if not thinking_msg:
-        thinking_msg = await channel.send(status_msg)
-    else:
-        await thinking_msg.edit(content=status_msg)
 
-    reply = query_poe(user.id, user_query, attachment_contents, model=model, use_tutor_prompt=use_tutor)
-    await thinking_msg.delete()
+    with span("discord_status"):
+        if not thinking_msg:
+            thinking_msg = await channel.send(status_msg)
+        else:
+            await thinking_msg.edit(content=status_msg)
+
+    fallback_model = COMMANDS_BY_NAME[spec.fallback].model if spec.fallback else None
+
+    if STREAM_RESPONSES:
+        streamer = StreamingReply(channel, thinking_msg)
+        # Streamed edits happen inside the query_poe span
+        with span("query_poe"):
+            reply = await query_poe(user.id, user_query, attachment_contents, model=model,
+                                    use_tutor_prompt=use_tutor, on_delta=streamer.feed,
+                                    fallback_model=fallback_model, use_cache=spec.cacheable,
+                                    budget=spec.token_budget)
+        with span("discord_reply"):
+            await streamer.finish(reply)
+        return
 
-    if len(reply) > 2000:
-        chunks = [reply[i:i+2000] for i in range(0, len(reply), 2000)]
-        for chunk in chunks:
-            await channel.send(chunk)
-    else:
-        await channel.send(reply)
+    with span("query_poe"):
+        reply = await query_poe(user.id, user_query, attachment_contents, model=model,
+                                use_tutor_prompt=use_tutor, fallback_model=fallback_model,
+                                use_cache=spec.cacheable, budget=spec.token_budget)
+    with span("discord_reply"):
+        await thinking_msg.delete()
+
+        if len(reply) > 2000:
+            chunks = [reply[i:i+2000] for i in range(0, len(reply), 2000)]
+            for chunk in chunks:
+                await channel.send(chunk)
+        else:
+            await channel.send(reply)
+
+def command_tree_hash():
+    """Hash of the app commands as they'd be sent to Discord, plus the application id"""
+    payload = [command.to_dict(bot.tree) for command in bot.tree.get_commands()]
+    payload.sort(key=lambda command: command["name"])
+    text = json.dumps([bot.application_id, payload], sort_keys=True)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+async def sync_commands():
+    """Sync slash commands only if the tree changed since the last successful sync"""
+    tree_hash = command_tree_hash()
+    try:
+        with open(COMMAND_TREE_HASH_FILE, 'r') as f:
+            if f.read().strip() == tree_hash:
+                log.info("Slash commands unchanged, skipping sync")
+                return
+    except FileNotFoundError:
+        pass
 
-@bot.event
-async def on_ready():
-    load_persistent_data()
-    print(f'✅ Logged in as {bot.user}')
-    print(f'✅ Bot is ready!')
-    print(f'Admin User IDs: {ADMIN_IDS}')
-    print(f'Admin Role Name: {ADMIN_ROLE_NAME}')
-    print(f'⚠️  WARNING: File persistence will be lost on Railway restarts!')
-
-    # Sync slash commands
     try:
         synced = await bot.tree.sync()
-        print(f'✅ Synced {len(synced)} slash command(s)')
+        log.info("Synced %d slash command(s)", len(synced))
     except Exception as e:
-        print(f'❌ Failed to sync commands: {e}')
+        log.error("Failed to sync commands: %s", e)
+        return
+    try:
+        atomic_write(COMMAND_TREE_HASH_FILE, tree_hash)
+    except OSError as e:
+        log.error("Error saving %s: %s", COMMAND_TREE_HASH_FILE, e)
 
-    bot.loop.create_task(check_bot_state_loop())
+gateway_connected = False
+
+@bot.event
+async def on_disconnect():
+    global gateway_connected
+    gateway_connected = False
+
+@bot.event
+async def on_resumed():
+    global gateway_connected
+    gateway_connected = True
+
+loop_monitor = LoopMonitor(LOOP_PROBE_INTERVAL, LOOP_BLOCK_THRESHOLD_MS / 1000)
+
+def ready_check():
+    """Ready when the gateway is connected, the loop is responsive and no model circuit is open"""
+    loop_lag = loop_monitor.current_lag()
+    open_circuits = [model for model, state, *_ in model_guards.status() if state == "open"]
+    details = {
+        "gateway_connected": gateway_connected,
+        "loop_lag_seconds": round(loop_lag, 3),
+        "open_circuits": open_circuits,
+    }
+    ready = gateway_connected and loop_lag < READY_MAX_LOOP_LAG and not open_circuits
+    return ready, details
+
+histories = {"tutor": tutor_conversation_history, "standard": standard_conversation_history}
+metrics.gauge("gateway_connected", "1 while connected to the Discord gateway",
+              lambda: int(gateway_connected))
+metrics.gauge("loop_lag_seconds", "Latest event loop lag", lambda: loop_monitor.current_lag())
+metrics.gauge("loop_max_lag_seconds", "Largest event loop lag since startup", lambda: loop_monitor.max_lag)
+metrics.gauge("loop_blocked_seconds_total", "Event loop lag accumulated by probes over the block threshold",
+              lambda: loop_monitor.blocked_seconds, kind="counter")
+metrics.gauge("loop_blocked_probes_total", "Lag probes that woke up over the block threshold late",
+              lambda: loop_monitor.blocked_probes, kind="counter")
+metrics.gauge("loop_stalls_total", "Stalls whose blocking stack was captured by the watchdog",
+              lambda: loop_monitor.stall_count, kind="counter")
+metrics.gauge("queued_requests", "Commands waiting for a scheduler slot", lambda: command_scheduler.pending)
+metrics.gauge("running_requests", "Commands being processed", lambda: len(command_scheduler.running))
+metrics.gauge("model_in_flight", "Poe requests in flight per model",
+              lambda: {(model,): in_flight for model, _, in_flight, _, _ in model_guards.status()},
+              labels=("model",))
+metrics.gauge("model_circuit_state", "Circuit breaker state per model (0 closed, 1 half-open, 2 open)",
+              lambda: {(model,): {"closed": 0, "half-open": 1, "open": 2}[state]
+                       for model, state, *_ in model_guards.status()},
+              labels=("model",))
+metrics.gauge("history_users", "Users with history in memory",
+              lambda: {(name,): len(history.users) for name, history in histories.items()},
+              labels=("history",))
+metrics.gauge("history_bytes", "Estimated size of history held in memory",
+              lambda: {(name,): history.total_bytes for name, history in histories.items()},
+              labels=("history",))
+metrics.gauge("history_summaries", "Users with a running summary in memory",
+              lambda: {(name,): len(history.summaries) for name, history in histories.items()},
+              labels=("history",))
+metrics.gauge("attachment_blob_bytes", "Size of attachment payloads held in memory",
+              lambda: blob_store.total_bytes)
+metrics.gauge("rate_limited_users", "Users with recent messages tracked by the rate limiter",
+              lambda: len(rate_limiter))
+metrics.gauge("user_acceptances", "Stored non-tutor agreements", lambda: len(user_acceptances))
+metrics.gauge("response_cache_entries", "Responses held in the in-memory cache", lambda: len(response_cache))
+metrics.gauge("response_cache_events_total", "Response cache lookups and evictions",
+              lambda: {(event,): count for event, count in response_cache.stats.items()},
+              labels=("event",), kind="counter")
+metrics.gauge("coalesced_requests_total", "Requests that reused an identical in-flight request",
+              lambda: inflight_requests.coalesced, kind="counter")
+
+ops_server = OpsServer(OPS_HOST, OPS_PORT, ready_check, metrics.render)
+ops_server.add_json('/loopz', loop_monitor.report)
+
+@bot.event
+async def on_ready():
+    # Runs on every reconnect too; one-time startup is in TutorBot.setup_hook
+    global gateway_connected
+    gateway_connected = True
+    log.info("Logged in as %s", bot.user)
+    log.info("Bot is ready!")
+    log.info("Admin User IDs: %s", ADMIN_IDS)
+    log.info("Admin Role Name: %s", ADMIN_ROLE_NAME)
+    log.warning("File persistence will be lost on Railway restarts!")
 
 async def check_bot_state_loop():
     """Background task to check if bot should be re-enabled"""
@@ -556,101 +1206,112 @@ async def check_bot_state_loop():
         check_bot_state()
         await asyncio.sleep(60)
 
-# Slash Commands
-@bot.tree.command(name="help", description="Show all available commands")
-async def slash_help(interaction: discord.Interaction):
-    help_text = """**Mr. Tutor Bot Commands:**
+def sweep_memory():
+    """Evict idle, excess and over-budget per-user state"""
+    histories = (tutor_conversation_history, standard_conversation_history)
+    cutoff = time.monotonic() - HISTORY_IDLE_TTL
+    for history in histories:
+        eviction_stats["idle"] += history.evict_idle(cutoff)
+        eviction_stats["lru"] += history.evict_lru(HISTORY_MAX_USERS)
+
+    # Over the byte budget: evict whichever history's least recent user is older
+    while sum(h.total_bytes for h in histories) > HISTORY_MAX_BYTES:
+        candidates = [(h.oldest_user(), h) for h in histories if h.users]
+        if not candidates:
+            break
+        (user_id, _), history = min(candidates, key=lambda c: c[0][1])
+        history.unload(user_id)
+        eviction_stats["memory"] += 1
+
+    # Drop rate limit windows whose events have all expired
+    eviction_stats["rate_limit_users"] += rate_limiter.prune(datetime.now().timestamp())
+
+async def memory_sweep_loop():
+    """Background task to evict idle per-user state"""
+    while True:
+        await asyncio.sleep(MEMORY_SWEEP_INTERVAL)
+        sweep_memory()
+        try:
+            await conversation_store.collect_garbage()
+        except Exception as e:
+            log.error("Error cleaning up conversation store: %s", e)
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, response_cache.prune_disk)
+        except Exception as e:
+            log.error("Error cleaning up response cache: %s", e)
 
-**Tutor Commands (with teaching prompts):**
-/tutor <message> — Kimi-K2-Instruct (Mr. Tutor)
-/tutorplus <message> — Gemini-3-Flash (Mr. Tutor)
-/tutorminus <message> — Gemini-2.5-Flash-Lite (Mr. Tutor)
+async def clear_history(user_id):
+    """Clear both of a user's histories; returns (tutor_cleared, standard_cleared)"""
+    cleared = (await tutor_conversation_history.exists(user_id),
+               await standard_conversation_history.exists(user_id))
+    tutor_conversation_history.clear(user_id)
+    standard_conversation_history.clear(user_id)
+    return cleared
 
-**Standard Commands (no teaching prompts):**
-/standard <message> — Kimi-K2-Instruct (no tutor)
-/standardplus <message> — Gemini-3-Flash (no tutor)
-/standardminus <message> — Gemini-2.5-Flash-Lite (no tutor)
+# Slash Commands
+def help_text(prefix_forms=False):
+    """Command list built from COMMANDS; prefix_forms also lists the $ form of each command"""
+    sections = (
+        ("Tutor Commands (with teaching prompts)", lambda spec: spec.tutor, " (Mr. Tutor)"),
+        ("Standard Commands (no teaching prompts)", lambda spec: not spec.tutor and not spec.image, " (no tutor)"),
+        ("Image Commands", lambda spec: spec.image, ""),
+    )
+    lines = ["**Mr. Tutor Bot Commands:**"]
+    for title, include, suffix in sections:
+        lines.append(f"\n**{title}:**")
+        for spec in COMMANDS:
+            if include(spec):
+                arg = "<prompt>" if spec.image else "<message>"
+                usage = f"/{spec.name} {arg}"
+                if prefix_forms:
+                    usage += f" or ${spec.name} {arg}"
+                lines.append(f"{usage} — {spec.label}{suffix}")
+
+    lines.append("\n**Utility:**")
+    lines.append("/clear — Clear your conversation history (separate for tutor/standard)")
+    shortcuts = ", ".join(f"${alias}" for spec in COMMANDS for alias in spec.aliases)
+    lines.append(f"\n**Old $ shortcuts still work:** {shortcuts}")
+    return "\n".join(lines)
 
-**Image Commands:**
-/image <prompt> — FLUX-schnell
-/imageplus <prompt> — GPT-Image-1-Mini (low quality)
+@bot.tree.command(name="help", description="Show all available commands")
+async def slash_help(interaction: discord.Interaction):
+    await interaction.response.send_message(help_text(), ephemeral=True)
 
-**Utility:**
-/clear — Clear your conversation history (separate for tutor/standard)
+async def run_slash_command(interaction, spec, text):
+    trace = tracer.start("command", source="slash", command=spec.name, user_id=interaction.user.id,
+                         command_type=spec.command_type, model=spec.model)
+    try:
+        with span("discord_defer"):
+            await interaction.response.defer()
+            if spec.image:
+                thinking = "🎨 Generating image..."
+            elif spec.tutor:
+                thinking = "📚 Mr. Tutor is thinking..."
+            else:
+                thinking = "🤖 AI is thinking..."
+            thinking_msg = await interaction.followup.send(thinking)
+        await process_command_logic(interaction.channel, interaction.user, text, [],
+                                    spec.model, spec.tutor, spec.command_type, text, spec.image, thinking_msg)
+    finally:
+        tracer.release(trace)
+
+def slash_command(spec):
+    """Build the app command for a model command; image commands take a prompt"""
+    if spec.image:
+        async def callback(interaction: discord.Interaction, prompt: str):
+            await run_slash_command(interaction, spec, prompt)
+    else:
+        async def callback(interaction: discord.Interaction, message: str):
+            await run_slash_command(interaction, spec, message)
+    return app_commands.Command(name=spec.name, description=spec.description, callback=callback)
 
-**Old $ shortcuts still work:** $t, $t+, $t-, $ti, $ti+, $tn, $tn+, $tn-
-"""
-    await interaction.response.send_message(help_text, ephemeral=True)
-
-@bot.tree.command(name="tutor", description="Ask Mr. Tutor (Kimi-K2-Instruct)")
-async def slash_tutor(interaction: discord.Interaction, message: str):
-    await interaction.response.defer()
-    thinking_msg = await interaction.followup.send("📚 Mr. Tutor is thinking...")
-    await process_command_logic(interaction.channel, interaction.user, message, [],
-                                "tester-kimi-k2-non", True, "normal", message, False, thinking_msg)
-
-@bot.tree.command(name="tutorplus", description="Ask Mr. Tutor (Gemini-3-Flash)")
-async def slash_tutorplus(interaction: discord.Interaction, message: str):
-    await interaction.response.defer()
-    thinking_msg = await interaction.followup.send("📚 Mr. Tutor is thinking...")
-    await process_command_logic(interaction.channel, interaction.user, message, [],
-                                "Gemini-2.5-Flash-Tut", True, "plus", message, False, thinking_msg)
-
-@bot.tree.command(name="tutorminus", description="Ask Mr. Tutor (Gemini-2.5-Flash-Lite)")
-async def slash_tutorminus(interaction: discord.Interaction, message: str):
-    await interaction.response.defer()
-    thinking_msg = await interaction.followup.send("📚 Mr. Tutor is thinking...")
-    await process_command_logic(interaction.channel, interaction.user, message, [],
-                                "Gemini-2.5-Flash-Lite", True, "minus", message, False, thinking_msg)
-
-@bot.tree.command(name="standard", description="Ask Kimi-K2-Instruct (no tutor prompt)")
-async def slash_standard(interaction: discord.Interaction, message: str):
-    await interaction.response.defer()
-    thinking_msg = await interaction.followup.send("🤖 AI is thinking...")
-    await process_command_logic(interaction.channel, interaction.user, message, [],
-                                "tester-kimi-k2-non", False, "nonnormal", message, False, thinking_msg)
-
-@bot.tree.command(name="standardplus", description="Ask Gemini-3-Flash (no tutor prompt)")
-async def slash_standardplus(interaction: discord.Interaction, message: str):
-    await interaction.response.defer()
-    thinking_msg = await interaction.followup.send("🤖 AI is thinking...")
-    await process_command_logic(interaction.channel, interaction.user, message, [],
-                                "Gemini-2.5-Flash-Tut", False, "nonplus", message, False, thinking_msg)
-
-@bot.tree.command(name="standardminus", description="Ask Gemini-2.5-Flash-Lite (no tutor prompt)")
-async def slash_standardminus(interaction: discord.Interaction, message: str):
-    await interaction.response.defer()
-    thinking_msg = await interaction.followup.send("🤖 AI is thinking...")
-    await process_command_logic(interaction.channel, interaction.user, message, [],
-                                "Gemini-2.5-Flash-Lite", False, "nonminus", message, False, thinking_msg)
-
-@bot.tree.command(name="image", description="Generate image with FLUX-schnell")
-async def slash_image(interaction: discord.Interaction, prompt: str):
-    await interaction.response.defer()
-    thinking_msg = await interaction.followup.send("🎨 Generating image...")
-    await process_command_logic(interaction.channel, interaction.user, prompt, [],
-                                "FLUX-schnell", False, "image", prompt, True, thinking_msg)
-
-@bot.tree.command(name="imageplus", description="Generate image with GPT-Image-1-Mini (low quality)")
-async def slash_imageplus(interaction: discord.Interaction, prompt: str):
-    await interaction.response.defer()
-    thinking_msg = await interaction.followup.send("🎨 Generating image...")
-    await process_command_logic(interaction.channel, interaction.user, prompt, [],
-                                "GPT-Image-1-Mini", False, "imageplus", prompt, True, thinking_msg)
+for spec in COMMANDS:
+    bot.tree.add_command(slash_command(spec))
 
 @bot.tree.command(name="clear", description="Clear your conversation history")
 async def slash_clear(interaction: discord.Interaction):
     user_id = interaction.user.id
-    tutor_cleared = False
-    standard_cleared = False
-    
-    if user_id in tutor_conversation_history:
-        tutor_conversation_history[user_id].clear()
-        tutor_cleared = True
-    
-    if user_id in standard_conversation_history:
-        standard_conversation_history[user_id].clear()
-        standard_cleared = True
+    tutor_cleared, standard_cleared = await clear_history(user_id)
     
     if tutor_cleared or standard_cleared:
         msg = "✅ Your conversation history has been cleared!"
@@ -666,7 +1327,7 @@ async def slash_clear(interaction: discord.Interaction):
                                                ephemeral=True)
 
 # Admin Slash Commands
-@bot.tree.command(name="setgloballimit", description="[ADMIN] Set global rate limit for a command")
+@bot.tree.command(name="setgloballimit", description="[ADMIN] Set server-wide rate limit for a command type or model")
 async def slash_setgloballimit(interaction: discord.Interaction, command: str, per_min: int, per_10min: int, per_hour: int):
     if not is_admin(interaction.user.id, interaction.user):
         await interaction.response.send_message("❌ Sorry, but you need admin permissions to use this command.", 
@@ -679,7 +1340,7 @@ async def slash_setgloballimit(interaction: discord.Interaction, command: str, p
         "per_hour": per_hour
     }
     save_rate_limits()
-    print(f"[ADMIN] Global rate limit set for {command}: {per_min}/min, {per_10min}/10min, {per_hour}/hour")
+    log.info("[ADMIN] Global rate limit set for %s: %d/min, %d/10min, %d/hour", command, per_min, per_10min, per_hour)
     await interaction.response.send_message(f"✅ **Global rate limit set for `{command}`**\n📊 Limits: {per_min}/min, {per_10min}/10min, {per_hour}/hour")
 
 @bot.tree.command(name="setuserlimit", description="[ADMIN] Set rate limit for a specific user")
@@ -706,10 +1367,10 @@ async def slash_setuserlimit(interaction: discord.Interaction, user: discord.Use
     save_rate_limits()
     
     duration_text = f"{duration_hours} hours" if duration_hours > 0 else "permanently"
-    print(f"[ADMIN] User rate limit set for {user.name} on {command}")
+    log.info("[ADMIN] User rate limit set for %s on %s", user.name, command)
     await interaction.response.send_message(f"✅ **Rate limit set for {user.mention}**\n📝 Command: `{command}`\n⏱️ Duration: {duration_text}\n📊 Limits: {per_min}/min, {per_10min}/10min, {per_hour}/hour")
 
-@bot.tree.command(name="removegloballimit", description="[ADMIN] Remove global rate limit for a command")
+@bot.tree.command(name="removegloballimit", description="[ADMIN] Remove server-wide rate limit for a command type or model")
 async def slash_removegloballimit(interaction: discord.Interaction, command: str):
     if not is_admin(interaction.user.id, interaction.user):
         await interaction.response.send_message("❌ Sorry, but you need admin permissions to use this command.", 
@@ -719,7 +1380,7 @@ async def slash_removegloballimit(interaction: discord.Interaction, command: str
     if command in rate_limits["global"]:
         del rate_limits["global"][command]
         save_rate_limits()
-        print(f"[ADMIN] Global rate limit removed for {command}")
+        log.info("[ADMIN] Global rate limit removed for %s", command)
         await interaction.response.send_message(f"✅ Global rate limit removed for `{command}`")
     else:
         await interaction.response.send_message(f"❌ No global rate limit found for `{command}`")
@@ -736,7 +1397,7 @@ async def slash_removeuserlimit(interaction: discord.Interaction, user: discord.
     if user_id_str in rate_limits["users"] and command in rate_limits["users"][user_id_str]:
         del rate_limits["users"][user_id_str][command]
         save_rate_limits()
-        print(f"[ADMIN] User rate limit removed for {user.name} on {command}")
+        log.info("[ADMIN] User rate limit removed for %s on %s", user.name, command)
         await interaction.response.send_message(f"✅ Rate limit removed for {user.mention} on `{command}`")
     else:
         await interaction.response.send_message(f"❌ No rate limit found for {user.mention} on `{command}`")
@@ -752,11 +1413,11 @@ async def slash_togglebot(interaction: discord.Interaction, minutes: float):
     
     if minutes > 0:
         bot_state["disable_until"] = (datetime.now() + timedelta(minutes=minutes)).timestamp()
-        print(f"[ADMIN] Bot disabled for {minutes} minutes")
+        log.info("[ADMIN] Bot disabled for %s minutes", minutes)
         await interaction.response.send_message(f"🔴 **Bot disabled for {minutes} minutes.**")
     else:
         bot_state["disable_until"] = None
-        print(f"[ADMIN] Bot disabled indefinitely")
+        log.info("[ADMIN] Bot disabled indefinitely")
         await interaction.response.send_message("🔴 **Bot disabled indefinitely until re-enabled.**")
     
     save_bot_state()
@@ -771,259 +1432,280 @@ async def slash_enablebot(interaction: discord.Interaction):
     bot_state["enabled"] = True
     bot_state["disable_until"] = None
     save_bot_state()
-    print(f"[ADMIN] Bot re-enabled")
+    log.info("[ADMIN] Bot re-enabled")
     await interaction.response.send_message("🟢 **Bot re-enabled!**")
 
-# Prefix Commands ($ commands)
-@bot.event
-async def on_message(message):
-    if message.author == bot.user:
+@bot.tree.command(name="memorystats", description="[ADMIN] Show per-user memory usage and evictions")
+async def slash_memorystats(interaction: discord.Interaction):
+    if not is_admin(interaction.user.id, interaction.user):
+        await interaction.response.send_message("❌ Sorry, but you need admin permissions to use this command.", 
+                                                ephemeral=True)
         return
 
-    # Check bot state
-    if not check_bot_state():
-        if not is_admin(message.author.id, message.author):
-            return
+    history_mb = (tutor_conversation_history.total_bytes + standard_conversation_history.total_bytes) / (1024 * 1024)
+    await interaction.response.send_message(
+        f"📊 **Memory usage**\n"
+        f"Tutor histories: {len(tutor_conversation_history)} users\n"
+        f"Standard histories: {len(standard_conversation_history)} users\n"
+        f"History size: {history_mb:.1f} MB of {HISTORY_MAX_BYTES / (1024 * 1024):.0f} MB\n"
+        f"Stored blobs: {len(blob_store)} ({blob_store.total_bytes / (1024 * 1024):.1f} MB)\n"
+        f"Rate limit users tracked: {len(rate_limiter)}\n"
+        f"Response cache: {len(response_cache)} entries, {response_cache.stats['hits']} hits, "
+        f"{response_cache.stats['disk_hits']} disk hits, {response_cache.stats['misses']} misses\n"
+        f"Coalesced requests: {inflight_requests.coalesced} ({len(inflight_requests)} in flight)\n"
+        f"Evictions: {eviction_stats['idle']} idle, {eviction_stats['lru']} LRU, "
+        f"{eviction_stats['memory']} memory, {eviction_stats['rate_limit_users']} rate limit users",
+        ephemeral=True
+    )
+
+@bot.tree.command(name="modelstatus", description="[ADMIN] Show per-model load and circuit breaker state")
+async def slash_modelstatus(interaction: discord.Interaction):
+    if not is_admin(interaction.user.id, interaction.user):
+        await interaction.response.send_message("❌ Sorry, but you need admin permissions to use this command.", 
+                                                ephemeral=True)
+        return
 
-    # Handle $ prefix commands
-    content_lower = message.content.lower()
+    status = model_guards.status()
+    if not status:
+        await interaction.response.send_message("No models have been called yet.", ephemeral=True)
+        return
 
-    # Help
-    if content_lower.startswith("$help"):
-        help_text = """**Mr. Tutor Bot Commands:**
+    state_emoji = {"closed": "🟢", "half-open": "🟡", "open": "🔴"}
+    lines = [
+        f"{state_emoji[state]} `{model}` — {state}, {in_flight}/{limit} in flight, {failures} recent failures"
+        for model, state, in_flight, limit, failures in status
+    ]
+    await interaction.response.send_message("📊 **Model status**\n" + "\n".join(lines), ephemeral=True)
 
-**Tutor Commands (with teaching prompts):**
-/tutor <message> or $tutor <message> — Kimi-K2-Instruct (Mr. Tutor)
-...
-"""
-        await message.channel.send(help_text)
+@bot.tree.command(name="loophealth", description="[ADMIN] Show event loop lag and the last blocking call")
+async def slash_loophealth(interaction: discord.Interaction):
+    if not is_admin(interaction.user.id, interaction.user):
+        await interaction.response.send_message("❌ Sorry, but you need admin permissions to use this command.", 
+                                                ephemeral=True)
         return
 
-    # Clear
-    if content_lower.startswith("$clear"):
-        user_id = message.author.id
-        tutor_cleared = False
-        standard_cleared = False
-        
-        if user_id in tutor_conversation_history:
-            tutor_conversation_history[user_id].clear()
-            tutor_cleared = True
-        
-        if user_id in standard_conversation_history:
-            standard_conversation_history[user_id].clear()
-            standard_cleared = True
-        
-        if tutor_cleared or standard_cleared:
-            msg = "✅ Your conversation history has been cleared!"
-            if tutor_cleared and standard_cleared:
-                msg += " (Both tutor and standard histories)"
-            elif tutor_cleared:
-                msg += " (Tutor history)"
-            else:
-                msg += " (Standard history)"
-            await message.channel.send(msg)
+    report = loop_monitor.report()
+    text = (
+        f"🩺 **Event loop health**\n"
+        f"Lag: {report['lag_seconds'] * 1000:.0f} ms (max {report['max_lag_seconds'] * 1000:.0f} ms)\n"
+        f"Blocked: {report['blocked_seconds']:.1f}s over {report['blocked_probes']} probes "
+        f"(threshold {LOOP_BLOCK_THRESHOLD_MS:.0f} ms)\n"
+        f"Stalls captured: {report['stalls']}"
+    )
+    if report["recent_stalls"]:
+        stall = report["recent_stalls"][-1]
+        stalled_at = datetime.fromtimestamp(stall["at"]).strftime("%H:%M:%S")
+        header = f"\n\n**Last stall** at {stalled_at}, blocked ≥{stall['blocked_for'] * 1000:.0f} ms:\n"
+        room = DISCORD_MESSAGE_LIMIT - len(text) - len(header) - 8
+        text += f"{header}```\n{stall['stack'][-room:]}```"
+    await interaction.response.send_message(text, ephemeral=True)
+
+# Prefix Commands ($ commands)
+async def prefix_help(message, query):
+    await message.channel.send(help_text(prefix_forms=True))
+
+async def prefix_clear(message, query):
+    user_id = message.author.id
+    tutor_cleared, standard_cleared = await clear_history(user_id)
+
+    if tutor_cleared or standard_cleared:
+        msg = "✅ Your conversation history has been cleared!"
+        if tutor_cleared and standard_cleared:
+            msg += " (Both tutor and standard histories)"
+        elif tutor_cleared:
+            msg += " (Tutor history)"
         else:
-            await message.channel.send("You don't have any conversation history yet.")
+            msg += " (Standard history)"
+        await message.channel.send(msg)
+    else:
+        await message.channel.send("You don't have any conversation history yet.")
+
+async def prefix_setgloballimit(message, query):
+    parts = message.content.split()
+    if len(parts) < 5:
+        await message.channel.send("❌ Usage: `$setgloballimit <command> <per_min> <per_10min> <per_hour>`")
         return
 
-    # Admin commands (old $ style)
-    if is_admin(message.author.id, message.author):
-        if content_lower.startswith("$setgloballimit"):
-            parts = message.content.split()
-            if len(parts) < 5:
-                await message.channel.send("❌ Usage: `$setgloballimit <command> <per_min> <per_10min> <per_hour>`")
-                return
+    command = parts[1]
+    try:
+        per_min = int(parts[2])
+        per_10min = int(parts[3])
+        per_hour = int(parts[4])
+    except ValueError:
+        await message.channel.send("❌ Invalid numbers for rate limits.")
+        return
 
-            command = parts[1]
-            try:
-                per_min = int(parts[2])
-                per_10min = int(parts[3])
-                per_hour = int(parts[4])
-            except ValueError:
-                await message.channel.send("❌ Invalid numbers for rate limits.")
-                return
+    rate_limits["global"][command] = {
+        "per_minute": per_min,
+        "per_10min": per_10min,
+        "per_hour": per_hour
+    }
+    save_rate_limits()
+    log.info("[ADMIN] Global rate limit set for %s: %d/min, %d/10min, %d/hour", command, per_min, per_10min, per_hour)
+    await message.channel.send(f"✅ **Global rate limit set for `{command}`**\n📊 Limits: {per_min}/min, {per_10min}/10min, {per_hour}/hour")
 
-            rate_limits["global"][command] = {
-                "per_minute": per_min,
-                "per_10min": per_10min,
-                "per_hour": per_hour
-            }
-            save_rate_limits()
-            print(f"[ADMIN] Global rate limit set for {command}: {per_min}/min, {per_10min}/10min, {per_hour}/hour")
-            await message.channel.send(f"✅ **Global rate limit set for `{command}`**\n📊 Limits: {per_min}/min, {per_10min}/10min, {per_hour}/hour")
-            return
+async def prefix_setuserlimit(message, query):
+    parts = message.content.split()
+    if len(parts) < 7:
+        await message.channel.send("❌ Usage: `$setuserlimit <@user> <command> <duration_hours> <per_min> <per_10min> <per_hour>`")
+        return
 
-        if content_lower.startswith("$setuserlimit"):
-            parts = message.content.split()
-            if len(parts) < 7:
-                await message.channel.send("❌ Usage: `$setuserlimit <@user> <command> <duration_hours> <per_min> <per_10min> <per_hour>`")
-                return
+    if not message.mentions:
+        await message.channel.send("❌ Please mention a user.")
+        return
 
-            if not message.mentions:
-                await message.channel.send("❌ Please mention a user.")
-                return
+    target_user = message.mentions[0]
+    command = parts[2]
 
-            target_user = message.mentions[0]
-            command = parts[2]
+    try:
+        duration_hours = float(parts[3])
+        per_min = int(parts[4])
+        per_10min = int(parts[5])
+        per_hour = int(parts[6])
+    except ValueError:
+        await message.channel.send("❌ Invalid numbers for rate limits or duration.")
+        return
 
-            try:
-                duration_hours = float(parts[3])
-                per_min = int(parts[4])
-                per_10min = int(parts[5])
-                per_hour = int(parts[6])
-            except ValueError:
-                await message.channel.send("❌ Invalid numbers for rate limits or duration.")
-                return
+    user_id_str = str(target_user.id)
+    if user_id_str not in rate_limits["users"]:
+        rate_limits["users"][user_id_str] = {}
 
-            user_id_str = str(target_user.id)
-            if user_id_str not in rate_limits["users"]:
-                rate_limits["users"][user_id_str] = {}
+    expires = None
+    if duration_hours > 0:
+        expires = (datetime.now() + timedelta(hours=duration_hours)).timestamp()
 
-            expires = None
-            if duration_hours > 0:
-                expires = (datetime.now() + timedelta(hours=duration_hours)).timestamp()
+    rate_limits["users"][user_id_str][command] = {
+        "per_minute": per_min,
+        "per_10min": per_10min,
+        "per_hour": per_hour,
+        "expires": expires
+    }
+    save_rate_limits()
 
-            rate_limits["users"][user_id_str][command] = {
-                "per_minute": per_min,
-                "per_10min": per_10min,
-                "per_hour": per_hour,
-                "expires": expires
-            }
-            save_rate_limits()
+    duration_text = f"{duration_hours} hours" if duration_hours > 0 else "permanently"
+    log.info("[ADMIN] User rate limit set for %s on %s", target_user.name, command)
+    await message.channel.send(f"✅ **Rate limit set for {target_user.mention}**\n📝 Command: `{command}`\n⏱️ Duration: {duration_text}\n📊 Limits: {per_min}/min, {per_10min}/10min, {per_hour}/hour")
 
-            duration_text = f"{duration_hours} hours" if duration_hours > 0 else "permanently"
-            print(f"[ADMIN] User rate limit set for {target_user.name} on {command}")
-            await message.channel.send(f"✅ **Rate limit set for {target_user.mention}**\n📝 Command: `{command}`\n⏱️ Duration: {duration_text}\n📊 Limits: {per_min}/min, {per_10min}/10min, {per_hour}/hour")
-            return
+async def prefix_removelimit(message, query):
+    parts = message.content.split()
+    if len(parts) < 3:
+        await message.channel.send("❌ Usage: `$removelimit global <command>` or `$removelimit user <@user> <command>`")
+        return
 
-        if content_lower.startswith("$removelimit"):
-            parts = message.content.split()
-            if len(parts) < 3:
-                await message.channel.send("❌ Usage: `$removelimit global <command>` or `$removelimit user <@user> <command>`")
-                return
+    limit_type = parts[1].lower()
 
-            limit_type = parts[1].lower()
+    if limit_type == "global":
+        command = parts[2]
+        if command in rate_limits["global"]:
+            del rate_limits["global"][command]
+            save_rate_limits()
+            log.info("[ADMIN] Global rate limit removed for %s", command)
+            await message.channel.send(f"✅ Global rate limit removed for `{command}`")
+        else:
+            await message.channel.send(f"❌ No global rate limit found for `{command}`")
 
-            if limit_type == "global":
-                command = parts[2]
-                if command in rate_limits["global"]:
-                    del rate_limits["global"][command]
-                    save_rate_limits()
-                    print(f"[ADMIN] Global rate limit removed for {command}")
-                    await message.channel.send(f"✅ Global rate limit removed for `{command}`")
-                else:
-                    await message.channel.send(f"❌ No global rate limit found for `{command}`")
-                return
+    elif limit_type == "user":
+        if not message.mentions:
+            await message.channel.send("❌ Please mention a user.")
+            return
 
-            elif limit_type == "user":
-                if not message.mentions:
-                    await message.channel.send("❌ Please mention a user.")
-                    return
+        target_user = message.mentions[0]
+        command = parts[3]
+        user_id_str = str(target_user.id)
 
-                target_user = message.mentions[0]
-                command = parts[3]
-                user_id_str = str(target_user.id)
+        if user_id_str in rate_limits["users"] and command in rate_limits["users"][user_id_str]:
+            del rate_limits["users"][user_id_str][command]
+            save_rate_limits()
+            log.info("[ADMIN] User rate limit removed for %s on %s", target_user.name, command)
+            await message.channel.send(f"✅ Rate limit removed for {target_user.mention} on `{command}`")
+        else:
+            await message.channel.send(f"❌ No rate limit found for {target_user.mention} on `{command}`")
 
-                if user_id_str in rate_limits["users"] and command in rate_limits["users"][user_id_str]:
-                    del rate_limits["users"][user_id_str][command]
-                    save_rate_limits()
-                    print(f"[ADMIN] User rate limit removed for {target_user.name} on {command}")
-                    await message.channel.send(f"✅ Rate limit removed for {target_user.mention} on `{command}`")
-                else:
-                    await message.channel.send(f"❌ No rate limit found for {target_user.mention} on `{command}`")
-                return
+async def prefix_togglebot(message, query):
+    parts = message.content.split()
+    if len(parts) < 2:
+        await message.channel.send("❌ Usage: `$togglebot <minutes>` (0 for infinite)")
+        return
 
-        if content_lower.startswith("$togglebot"):
-            parts = message.content.split()
-            if len(parts) < 2:
-                await message.channel.send("❌ Usage: `$togglebot <minutes>` (0 for infinite)")
-                return
+    try:
+        minutes = float(parts[1])
+    except ValueError:
+        await message.channel.send("❌ Invalid number for minutes.")
+        return
 
-            try:
-                minutes = float(parts[1])
-            except ValueError:
-                await message.channel.send("❌ Invalid number for minutes.")
-                return
+    bot_state["enabled"] = False
 
-            bot_state["enabled"] = False
+    if minutes > 0:
+        bot_state["disable_until"] = (datetime.now() + timedelta(minutes=minutes)).timestamp()
+        log.info("[ADMIN] Bot disabled for %s minutes", minutes)
+        await message.channel.send(f"🔴 **Bot disabled for {minutes} minutes.**")
+    else:
+        bot_state["disable_until"] = None
+        log.info("[ADMIN] Bot disabled indefinitely")
+        await message.channel.send("🔴 **Bot disabled indefinitely until re-enabled.**")
 
-            if minutes > 0:
-                bot_state["disable_until"] = (datetime.now() + timedelta(minutes=minutes)).timestamp()
-                print(f"[ADMIN] Bot disabled for {minutes} minutes")
-                await message.channel.send(f"🔴 **Bot disabled for {minutes} minutes.**")
-            else:
-                bot_state["disable_until"] = None
-                print(f"[ADMIN] Bot disabled indefinitely")
-                await message.channel.send("🔴 **Bot disabled indefinitely until re-enabled.**")
+    save_bot_state()
 
-            save_bot_state()
-            return
+async def prefix_enablebot(message, query):
+    bot_state["enabled"] = True
+    bot_state["disable_until"] = None
+    save_bot_state()
+    log.info("[ADMIN] Bot re-enabled")
+    await message.channel.send("🟢 **Bot re-enabled!**")
 
-        if content_lower.startswith("$enablebot"):
-            bot_state["enabled"] = True
-            bot_state["disable_until"] = None
-            save_bot_state()
-            print(f"[ADMIN] Bot re-enabled")
-            await message.channel.send("🟢 **Bot re-enabled!**")
-            return
+def model_command(prefix, model, use_tutor, command_type):
+    """Handler running a model command from a $ or mention message"""
+    is_image_gen = COMMANDS_BY_TYPE[command_type].image
 
-    # Parse regular commands - CHECK LONGER PREFIXES FIRST
-    command = None
-    model = None
-    use_tutor = True
-    command_type = None
-    user_query = None
-    is_image_gen = False
-
-    # Check for $ prefix commands
-    if message.content.startswith("$"):
-        for prefix, m, tutor, cmd_type in COMMAND_CONFIGS:
-            prefix_with_dollar = f"${prefix} "
-            prefix_with_dollar_no_space = f"${prefix}"
-
-            # Check with space or at end of message
-            if (content_lower.startswith(prefix_with_dollar) or
-                (content_lower == prefix_with_dollar_no_space)):
-                command = prefix
-                model = m
-                use_tutor = tutor
-                command_type = cmd_type
-                is_image_gen = cmd_type in ["image", "imageplus"]
-                user_query = message.content[len(prefix_with_dollar_no_space):].strip()
-                print(f"[DEBUG] Matched ${prefix} -> model: {model}, type: {cmd_type}")
-                break
+    async def handler(message, query):
+        trace = tracer.start("command", source="message", command=prefix, user_id=message.author.id,
+                             command_type=command_type, model=model)
+        log.debug("Matched %s -> model: %s, type: %s", prefix, model, command_type)
+        try:
+            await process_command_logic(message.channel, message.author, message.content,
+                                        message.attachments, model, use_tutor, command_type,
+                                        query, is_image_gen)
+        finally:
+            tracer.release(trace)
+    return handler
+
+# Built once: every $ and mention command, looked up by the message's first token
+dispatcher = Dispatcher(prefix="$")
+dispatcher.add("help", prefix_help)
+dispatcher.add("clear", prefix_clear)
+for name, handler in (("setgloballimit", prefix_setgloballimit), ("setuserlimit", prefix_setuserlimit),
+                      ("removelimit", prefix_removelimit), ("togglebot", prefix_togglebot),
+                      ("enablebot", prefix_enablebot)):
+    dispatcher.add(name, handler, admin=True)
+for spec in COMMANDS:
+    for name in (spec.name, *spec.aliases):
+        dispatcher.add(name, model_command(name, spec.model, spec.tutor, spec.command_type), mention=True)
+# Default to tutor if just mentioned
+default_spec = COMMANDS_BY_NAME[DEFAULT_MENTION_COMMAND]
+dispatcher.set_default_mention(default_spec.name, model_command(default_spec.name, default_spec.model,
+                                                                default_spec.tutor, default_spec.command_type))
 
-    # Check for @ mentions
-    if command is None and bot.user in message.mentions:
-        prefix_str = f'<@{bot.user.id}>'
-        clean_content = message.content.replace(prefix_str, '').strip()
-
-        for prefix, m, tutor, cmd_type in COMMAND_CONFIGS:
-            if clean_content.lower().startswith(f"{prefix} ") or clean_content.lower() == prefix:
-                command = prefix
-                model = m
-                use_tutor = tutor
-                command_type = cmd_type
-                is_image_gen = cmd_type in ["image", "imageplus"]
-                user_query = clean_content[len(prefix):].strip()
-                print(f"[DEBUG] Matched mention {prefix} -> model: {model}, type: {cmd_type}")
-                break
+@bot.event
+async def on_message(message):
+    if message.author == bot.user:
+        return
 
-        # Default to tutor if just mentioned
-        if command is None:
-            command = "tutor"
-            model = "tester-kimi-k2-non"
-            use_tutor = True
-            command_type = "normal"
-            user_query = clean_content
-            print(f"[DEBUG] Defaulted to 'tutor' for mention")
+    # Cheap reject for ordinary chatter: no $ prefix and no mention of the bot
+    mention = f'<@{bot.user.id}>' if bot.user in message.mentions else None
+    route, query = dispatcher.resolve(message.content, mention)
+    if route is None:
+        return
 
-    if command:
-        await process_command_logic(message.channel, message.author, message.content,
-                                    message.attachments, model, use_tutor, command_type,
-                                    user_query, is_image_gen)
+    # Admin checks iterate the member's roles, so only run them for commands
+    if route.admin or not check_bot_state():
+        if not is_admin(message.author.id, message.author):
+            return
+
+    await route.handler(message, query)
 
 if __name__ == "__main__":
-    from keep_alive import start as start_keep_alive
-    start_keep_alive()  # Start Flask server BEFORE bot.run()
-    bot.run(DISCORD_BOT_TOKEN)
+    log_listener = setup_logging(LOG_LEVEL, LOG_FORMAT == "json", LOG_FILE or None, int(LOG_MAX_MB * 1024 * 1024))
+    try:
+        bot.run(DISCORD_BOT_TOKEN, log_handler=None)  # Logging is already configured
+    finally:
+        log_listener.stop()
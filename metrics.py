@@ -0,0 +1,121 @@
+import bisect
+import math
+
+# Default histogram buckets in seconds, from fast cache hits to slow generations
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80)
+SIZE_BUCKETS = (1024, 16 * 1024, 128 * 1024, 512 * 1024, 1024 ** 2, 4 * 1024 ** 2, 8 * 1024 ** 2, 25 * 1024 ** 2)
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in pairs) + "}"
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    """A named metric with one series per combination of label values"""
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.series = {}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        for values in sorted(self.series, key=lambda values: tuple(map(str, values))):
+            lines.extend(self.render_series(values, self.series[values]))
+        return lines
+
+    def render_series(self, values, value):
+        return [f"{self.name}{format_labels(self.labels, values)} {format_value(value)}"]
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *label_values, amount=1):
+        self.series[label_values] = self.series.get(label_values, 0) + amount
+
+class Histogram(Metric):
+    """Cumulative bucket counts, sum and count per series.
+
+    observe() is one bisect and a few additions, cheap enough for the
+    request path.
+    """
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *label_values):
+        series = self.series.get(label_values)
+        if series is None:
+            # Per-bucket counts (the last one is +Inf), then sum
+            series = self.series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render_series(self, values, series):
+        lines = []
+        cumulative = 0
+        for bound, count in zip((*self.buckets, math.inf), series):
+            cumulative += count
+            labels = format_labels(self.labels, values, (("le", format_value(bound)),))
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = format_labels(self.labels, values)
+        lines.append(f"{self.name}_sum{labels} {format_value(series[-1])}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+class Gauge(Metric):
+    """A value read when metrics are scraped.
+
+    collect() returns the current value, or {label values tuple: value} for
+    a labelled gauge, so nothing is tracked on the request path. kind can
+    be "counter" for totals already counted elsewhere.
+    """
+
+    def __init__(self, name, help_text, collect, labels=(), kind="gauge"):
+        super().__init__(name, help_text, labels)
+        self.collect = collect
+        self.kind = kind
+
+    def render(self):
+        value = self.collect()
+        self.series = value if isinstance(value, dict) else {(): value}
+        return super().render()
+
+class MetricsRegistry:
+    """Holds the process's metrics and renders them in Prometheus text format"""
+
+    def __init__(self, prefix=""):
+        self.prefix = prefix
+        self.metrics = []
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._add(Counter(self.prefix + name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(self.prefix + name, help_text, labels, buckets))
+
+    def gauge(self, name, help_text, collect, labels=(), kind="gauge"):
+        return self._add(Gauge(self.prefix + name, help_text, collect, labels, kind))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,72 @@
+import asyncio
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+def atomic_write(filename, text):
+    """Write text to filename via a temp file and rename, so readers never see a partial file"""
+    tmp_filename = f"{filename}.tmp"
+    with open(tmp_filename, 'w') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_filename, filename)
+
+def log_failure(future):
+    if future.exception():
+        log.error("Error saving state: %s", future.exception())
+
+class WriteBehindWriter:
+    """Coalesces saves of JSON state files and writes them off the event loop.
+
+    mark_dirty() only records that a file changed; the first change starts a
+    timer, and when it fires every dirty file is serialized once on the loop
+    (a consistent snapshot) and written atomically on a worker thread. A
+    burst of changes within the delay costs one write per file.
+    """
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.sources = {}
+        self.dirty = set()
+        self.timer = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="persist")
+
+    def register(self, filename, get_data):
+        """get_data is called at flush time, so it may return a reassigned global"""
+        self.sources[filename] = get_data
+
+    def mark_dirty(self, filename):
+        self.dirty.add(filename)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+        if self.timer is None:
+            self.timer = loop.call_later(self.delay, self._flush_dirty)
+
+    def _snapshot(self):
+        snapshots = {
+            filename: json.dumps(self.sources[filename](), indent=2) for filename in self.dirty
+        }
+        self.dirty.clear()
+        return snapshots
+
+    def _flush_dirty(self):
+        self.timer = None
+        for filename, text in self._snapshot().items():
+            self.executor.submit(atomic_write, filename, text).add_done_callback(log_failure)
+
+    def flush(self):
+        """Write everything dirty now and wait for queued writes (used on shutdown)"""
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        for filename, text in self._snapshot().items():
+            self.executor.submit(atomic_write, filename, text).add_done_callback(log_failure)
+        # Waits for earlier writes too, since the single worker runs them in order
+        self.executor.submit(lambda: None).result()
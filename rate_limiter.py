@@ -0,0 +1,128 @@
+from collections import deque
+
+# (config key, window length in seconds, label), matching the rate_limits JSON format
+WINDOWS = (
+    ("per_minute", 60, "per minute"),
+    ("per_10min", 600, "per 10 minutes"),
+    ("per_hour", 3600, "per hour"),
+)
+LONGEST_WINDOW = WINDOWS[-1][1]
+
+class SlidingWindow:
+    """Timestamps of recent events, one deque per window.
+
+    Each event is appended to every deque and popped from the front once it
+    falls out of that window, so counting and recording are amortized O(1).
+    """
+    __slots__ = ("events",)
+
+    def __init__(self):
+        self.events = tuple(deque() for _ in WINDOWS)
+
+    def expire(self, now):
+        for (_, span, _), events in zip(WINDOWS, self.events):
+            while events and now - events[0] >= span:
+                events.popleft()
+
+    def exceeded(self, limit_config, now):
+        """Return the label of the first window over its limit, or None"""
+        self.expire(now)
+        for (key, _, label), events in zip(WINDOWS, self.events):
+            if key in limit_config and len(events) >= limit_config[key]:
+                return label
+        return None
+
+    def record(self, now):
+        for events in self.events:
+            events.append(now)
+
+    def wait_time(self, limit_config, now):
+        """Seconds until one more event fits in every window (inf if a limit is 0)"""
+        self.expire(now)
+        wait = 0.0
+        for (key, span, _), events in zip(WINDOWS, self.events):
+            if key not in limit_config or len(events) < limit_config[key]:
+                continue
+            if limit_config[key] <= 0:
+                return float("inf")
+            # The event whose expiry brings this window back under its limit
+            blocking = events[len(events) - limit_config[key]]
+            wait = max(wait, blocking + span - now)
+        return wait
+
+    def __bool__(self):
+        return bool(self.events[-1])
+
+class RateLimiter:
+    """Sliding windows keyed by user and command"""
+
+    def __init__(self):
+        self.users = {}
+
+    def __len__(self):
+        return len(self.users)
+
+    def exceeded(self, user_id, command, limit_config, now):
+        """Return the label of the window user_id is over for command, or None"""
+        window = self.users.get(user_id, {}).get(command)
+        if window is None:
+            return None
+        return window.exceeded(limit_config, now)
+
+    def record(self, user_id, command, now):
+        commands = self.users.setdefault(user_id, {})
+        window = commands.get(command)
+        if window is None:
+            window = commands[command] = SlidingWindow()
+        window.record(now)
+
+    def prune(self, now):
+        """Drop windows with no events left; returns the number of users removed"""
+        removed = 0
+        for user_id in list(self.users):
+            commands = self.users[user_id]
+            for command in list(commands):
+                commands[command].expire(now)
+                if not commands[command]:
+                    del commands[command]
+            if not commands:
+                del self.users[user_id]
+                removed += 1
+        return removed
+
+class GlobalLimiter:
+    """Server-wide admission shared by all users, keyed by command type or model.
+
+    Admission never blocks: a request over the limit is told how long until
+    there is room, and the scheduler holds its job without a worker slot
+    and tries again. Each check is O(1) per key.
+    """
+
+    def __init__(self):
+        self.windows = {}
+
+    def wait_time(self, limits, now):
+        wait = 0.0
+        for key, limit_config in limits:
+            window = self.windows.get(key)
+            if window is not None:
+                wait = max(wait, window.wait_time(limit_config, now))
+            elif any(limit_config.get(k, 1) <= 0 for k, _, _ in WINDOWS):
+                return float("inf")
+        return wait
+
+    def try_acquire(self, limits, now):
+        """Admit one request against every (key, limit_config) in limits.
+
+        Returns 0 once the request is recorded, otherwise the seconds until
+        it would fit (inf if a limit is 0), recording nothing.
+        """
+        wait = self.wait_time(limits, now)
+        if wait > 0:
+            return wait
+        for key, _ in limits:
+            window = self.windows.get(key)
+            if window is None:
+                window = self.windows[key] = SlidingWindow()
+            window.record(now)
+        return 0.0
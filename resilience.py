@@ -0,0 +1,215 @@
+import asyncio
+import logging
+import math
+import random
+import time
+from collections import deque
+
+import openai
+
+log = logging.getLogger(__name__)
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a model whose circuit breaker is open"""
+
+    def __init__(self, model, retry_in):
+        super().__init__(f"{model} is temporarily unavailable after repeated errors. "
+                         f"Please try again in {max(1, round(retry_in))} seconds or use another command.")
+        self.model = model
+        self.retry_in = retry_in
+
+def is_transient(error):
+    """Errors worth retrying and counting against a model's circuit breaker"""
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+def retry_after(error):
+    """Seconds requested by the server's Retry-After header, if any"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+class CircuitBreaker:
+    """Opens after failure_threshold consecutive failures.
+
+    While open, calls fail fast. After reset_timeout one probe call is let
+    through (half-open); its success closes the circuit, its failure
+    reopens it.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def retry_in(self):
+        if self.opened_at is None:
+            return 0
+        return max(0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def allow(self):
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.probing or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self.probing = False
+
+    def record_cancelled(self):
+        """A cancelled call says nothing about the model; let the next call probe"""
+        self.probing = False
+
+class ModelGuard:
+    """Concurrency limit and circuit breaker for one model"""
+
+    def __init__(self, max_concurrency, breaker):
+        self.max_concurrency = max_concurrency
+        self.breaker = breaker
+        self.in_flight = 0
+        self.semaphore = None
+
+    def get_semaphore(self):
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self.semaphore
+
+class ModelGuards:
+    """Per-model concurrency pools, retries with jittered backoff, and circuit breakers.
+
+    A failing model only uses up its own slots and fails fast once its
+    circuit opens, leaving capacity for the other models.
+    """
+
+    def __init__(self, default_concurrency, concurrency_limits=None, retries=2,
+                 base_delay=1.0, max_delay=20.0, failure_threshold=5, reset_timeout=30.0):
+        self.default_concurrency = default_concurrency
+        self.concurrency_limits = concurrency_limits or {}
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.guards = {}
+
+    def guard(self, model):
+        guard = self.guards.get(model)
+        if guard is None:
+            guard = self.guards[model] = ModelGuard(
+                self.concurrency_limits.get(model, self.default_concurrency),
+                CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            )
+        return guard
+
+    def backoff(self, attempt, error):
+        """Full-jitter exponential backoff, or the server's Retry-After when given"""
+        requested = retry_after(error)
+        if requested is not None:
+            return min(requested, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def call(self, model, fn, retryable=None):
+        """Await fn() under model's guard, retrying transient errors.
+
+        retryable(error) can veto a retry, e.g. once a streamed reply has
+        started. Raises CircuitOpenError without calling fn while the
+        model's circuit is open.
+        """
+        guard = self.guard(model)
+        attempt = 0
+        while True:
+            if not guard.breaker.allow():
+                raise CircuitOpenError(model, guard.breaker.retry_in())
+
+            async with guard.get_semaphore():
+                guard.in_flight += 1
+                try:
+                    result = await fn()
+                except asyncio.CancelledError:
+                    # E.g. a hedged primary losing the race; it may have been the half-open probe
+                    guard.breaker.record_cancelled()
+                    raise
+                except Exception as e:
+                    error = e
+                else:
+                    guard.breaker.record_success()
+                    return result
+                finally:
+                    guard.in_flight -= 1
+
+            if not is_transient(error):
+                # The model answered; the request itself was bad
+                guard.breaker.record_success()
+                raise error
+            guard.breaker.record_failure()
+            if attempt >= self.retries or (retryable and not retryable(error)):
+                raise error
+
+            delay = self.backoff(attempt, error)
+            log.debug("Retrying %s in %.1fs after error: %s", model, delay, error)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def status(self):
+        """Return [(model, state, in_flight, max_concurrency, consecutive failures)]"""
+        return [
+            (model, guard.breaker.state, guard.in_flight, guard.max_concurrency, guard.breaker.failures)
+            for model, guard in sorted(self.guards.items())
+        ]
+
+class LatencyTracker:
+    """Recent time-to-first-output samples per model, for hedging deadlines"""
+
+    def __init__(self, default_deadline, min_deadline, max_deadline, window=100, min_samples=20):
+        self.default_deadline = default_deadline
+        self.min_deadline = min_deadline
+        self.max_deadline = max_deadline
+        self.window = window
+        self.min_samples = min_samples
+        self.samples = {}
+
+    def record(self, model, seconds):
+        samples = self.samples.get(model)
+        if samples is None:
+            samples = self.samples[model] = deque(maxlen=self.window)
+        samples.append(seconds)
+
+    def p95(self, model):
+        samples = self.samples.get(model)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, math.ceil(len(ordered) * 0.95) - 1)]
+
+    def deadline(self, model):
+        """Seconds to wait for model's first output before hedging"""
+        p95 = self.p95(model)
+        if p95 is None:
+            return self.default_deadline
+        return min(self.max_deadline, max(self.min_deadline, p95))
@@ -0,0 +1,152 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+
+def normalize(value):
+    """Collapse whitespace in every string so trivially different prompts share a key"""
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, list):
+        return [normalize(item) for item in value]
+    if isinstance(value, dict):
+        return {key: normalize(item) for key, item in value.items()}
+    return value
+
+def cache_key(model, messages, **options):
+    """Hash of the model, the normalized messages and any request options"""
+    payload = json.dumps([model, normalize(messages), options], sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class ResponseCache:
+    """LRU cache of response text with a TTL and an optional on-disk tier.
+
+    Memory holds up to max_entries responses. With disk_dir set, responses
+    are also written there as JSON files so they survive restarts and
+    memory evictions; disk access runs in a worker thread.
+    """
+
+    def __init__(self, max_entries, ttl, disk_dir=None, max_disk_entries=10000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.max_disk_entries = max_disk_entries
+        self.entries = OrderedDict()
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def __len__(self):
+        return len(self.entries)
+
+    async def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            expires, value = entry
+            if time.time() < expires:
+                self.entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return value
+            del self.entries[key]
+
+        if self.disk_dir:
+            loop = asyncio.get_running_loop()
+            entry = await loop.run_in_executor(None, self._read_disk, key)
+            if entry is not None:
+                self._remember(key, entry)
+                self.stats["disk_hits"] += 1
+                return entry[1]
+
+        self.stats["misses"] += 1
+        return None
+
+    async def put(self, key, value):
+        entry = (time.time() + self.ttl, value)
+        self._remember(key, entry)
+        if self.disk_dir:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._write_disk, key, entry)
+
+    def _remember(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _read_disk(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if time.time() >= data["expires"]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            return None
+        return data["expires"], data["value"]
+
+    def _write_disk(self, key, entry):
+        tmp_path = f"{self._path(key)}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"expires": entry[0], "value": entry[1]}, f)
+        os.replace(tmp_path, self._path(key))
+
+    def prune_disk(self):
+        """Remove expired files, then the oldest beyond max_disk_entries (run in a thread)"""
+        if not self.disk_dir:
+            return
+        now = time.time()
+        files = []
+        for name in os.listdir(self.disk_dir):
+            path = os.path.join(self.disk_dir, name)
+            try:
+                mtime = os.path.getmtime(path)
+                if now - mtime >= self.ttl:
+                    os.remove(path)
+                else:
+                    files.append((mtime, path))
+            except FileNotFoundError:
+                continue
+        files.sort()
+        for _, path in files[:max(0, len(files) - self.max_disk_entries)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+class SingleFlight:
+    """Coalesces identical in-flight requests.
+
+    The first caller for a key runs the request; callers arriving while it
+    is in flight await the same result instead of starting their own. The
+    shared task is shielded, so one caller being cancelled doesn't cancel
+    it for the others.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self.calls)
+
+    async def do(self, key, fn):
+        """Return (result, shared); shared is True if another caller's request was reused"""
+        task = self.calls.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return await asyncio.shield(task), True
+
+        task = asyncio.ensure_future(fn())
+        self.calls[key] = task
+        task.add_done_callback(lambda _: self.calls.pop(key, None))
+        return await asyncio.shield(task), False
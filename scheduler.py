@@ -0,0 +1,104 @@
+import asyncio
+import logging
+from collections import deque
+
+log = logging.getLogger(__name__)
+
+class QueueFull(Exception):
+    """Raised when a job can't be queued; scope is "user" or "server" """
+
+    def __init__(self, scope):
+        super().__init__(f"{scope} queue is full")
+        self.scope = scope
+
+class FairScheduler:
+    """Runs queued jobs with at most one in flight per key.
+
+    Each key (a user and history type) has a bounded FIFO of jobs. Keys with
+    waiting work take turns round-robin, so one user queuing many requests
+    can't delay everyone else, and at most `workers` jobs run at once.
+
+    A job can also be gated by an admit() check, e.g. for server-wide rate
+    limits. A held job counts towards the queue limits but doesn't take a
+    worker slot, and its key keeps its turn while other keys' jobs start.
+    """
+
+    def __init__(self, workers, max_per_key, max_total):
+        self.workers = workers
+        self.max_per_key = max_per_key
+        self.max_total = max_total
+        self.queues = {}
+        self.ready = deque()  # Keys with queued jobs and nothing in flight, in turn order
+        self.running = set()
+        self.pending = 0
+        self.tasks = set()
+        self.retry = None  # Timer to re-dispatch once a held job may start
+
+    def submit(self, key, job, admit=None):
+        """Queue job (a coroutine function) under key.
+
+        admit, if given, is called when job is next to start and returns 0
+        to start it, or the seconds to hold it before asking again.
+
+        Returns 0 if it started right away, otherwise the number of jobs
+        waiting to start across all keys, including this one; round-robin
+        may start it ahead of some of them. Raises QueueFull if the key's
+        or the overall queue has no room.
+        """
+        queue = self.queues.get(key)
+        if queue is not None and len(queue) >= self.max_per_key:
+            raise QueueFull("user")
+        if self.pending >= self.max_total:
+            raise QueueFull("server")
+
+        if queue is None:
+            queue = self.queues[key] = deque()
+            if key not in self.running:
+                self.ready.append(key)
+        entry = (job, admit)
+        queue.append(entry)
+        self.pending += 1
+
+        self._dispatch()
+        if entry in self.queues.get(key, ()):
+            return self.pending
+        return 0
+
+    def _dispatch(self):
+        held = []
+        retry_in = None
+        while self.ready and len(self.running) < self.workers:
+            key = self.ready.popleft()
+            queue = self.queues[key]
+            job, admit = queue[0]
+            wait = admit() if admit is not None else 0
+            if wait > 0:
+                held.append(key)
+                retry_in = wait if retry_in is None else min(retry_in, wait)
+                continue
+            queue.popleft()
+            if not queue:
+                del self.queues[key]
+            self.pending -= 1
+            self.running.add(key)
+            task = asyncio.create_task(self._run(key, job))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+        # Held keys go first next time
+        self.ready.extendleft(reversed(held))
+        if retry_in is not None:
+            if self.retry is not None:
+                self.retry.cancel()
+            self.retry = asyncio.get_running_loop().call_later(retry_in, self._dispatch)
+
+    async def _run(self, key, job):
+        try:
+            await job()
+        except Exception as e:
+            log.exception("Error running queued request: %s", e)
+        finally:
+            self.running.discard(key)
+            if key in self.queues:
+                self.ready.append(key)
+            self._dispatch()
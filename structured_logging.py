@@ -0,0 +1,71 @@
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+
+from tracing import current_trace
+
+# Trace attributes copied onto every record logged while handling a request
+CONTEXT_FIELDS = ("user_id", "model", "command_type")
+
+class ContextQueueHandler(logging.handlers.QueueHandler):
+    """Queues records for the listener thread, stamped with the current request's context.
+
+    Unlike the stock QueueHandler, prepare() doesn't format the message;
+    the listener thread does that, so the caller only pays for the context
+    lookup and a queue put. Records below the logger's level never get
+    here, so disabled debug logging costs one level check.
+    """
+
+    def prepare(self, record):
+        trace = current_trace.get()
+        if trace is not None:
+            record.request_id = trace.request_id
+            for field in CONTEXT_FIELDS:
+                if field in trace.attrs and not hasattr(record, field):
+                    setattr(record, field, trace.attrs[field])
+        return record
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with the request context when there is one"""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for field in ("request_id", *CONTEXT_FIELDS):
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+def setup_logging(level="INFO", json_format=True, path=None, max_bytes=50 * 1024 * 1024):
+    """Route all logging through a queue to a background writer thread.
+
+    Writes to stdout, or to path with rotation. Returns the QueueListener,
+    which should be stopped on shutdown to flush queued records.
+    """
+    if path:
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=3, encoding="utf-8")
+    else:
+        handler = logging.StreamHandler(sys.stdout)
+    if json_format:
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    root = logging.getLogger()
+    root.handlers[:] = [ContextQueueHandler(log_queue)]
+    root.setLevel(level)
+    # discord.py's debug output is gateway traffic; keep it at INFO or above
+    logging.getLogger("discord").setLevel(max(root.level, logging.INFO))
+    listener.start()
+    return listener
@@ -0,0 +1,32 @@
+import math
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from rate_limiter import GlobalLimiter
+
+class GlobalLimiterTest(unittest.TestCase):
+    def test_admits_up_to_the_limit(self):
+        limiter = GlobalLimiter()
+        limits = [("t", {"per_minute": 2})]
+        self.assertEqual(limiter.try_acquire(limits, 100), 0)
+        self.assertEqual(limiter.try_acquire(limits, 110), 0)
+        self.assertEqual(limiter.try_acquire(limits, 120), 40)
+        self.assertEqual(limiter.try_acquire(limits, 160), 0)
+
+    def test_rejection_records_nothing(self):
+        limiter = GlobalLimiter()
+        limiter.try_acquire([("model", {"per_minute": 1})], 100)
+        limits = [("t", {"per_minute": 5}), ("model", {"per_minute": 1})]
+        self.assertEqual(limiter.try_acquire(limits, 110), 50)
+        # The rejected request didn't count against "t"
+        self.assertEqual(limiter.wait_time([("t", {"per_minute": 1})], 110), 0)
+
+    def test_zero_limit_never_admits(self):
+        limiter = GlobalLimiter()
+        self.assertEqual(limiter.try_acquire([("t", {"per_hour": 0})], 100), math.inf)
+
+if __name__ == "__main__":
+    unittest.main()
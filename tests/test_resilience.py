@@ -0,0 +1,42 @@
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import openai
+
+from resilience import ModelGuards
+
+class CancelledProbeTest(unittest.TestCase):
+    def test_cancelled_probe_lets_circuit_probe_again(self):
+        async def scenario():
+            guards = ModelGuards(4, retries=0, failure_threshold=1, reset_timeout=0.01)
+
+            async def failing():
+                raise openai.APIConnectionError(request=None)
+
+            with self.assertRaises(openai.APIConnectionError):
+                await guards.call("model", failing)
+            self.assertEqual(guards.guard("model").breaker.state, "open")
+            await asyncio.sleep(0.02)
+
+            # The half-open probe is cancelled, as a hedged primary would be
+            probe = asyncio.ensure_future(guards.call("model", lambda: asyncio.sleep(10)))
+            await asyncio.sleep(0)
+            probe.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await probe
+            self.assertFalse(guards.guard("model").breaker.probing)
+
+            async def healthy():
+                return "ok"
+
+            self.assertEqual(await guards.call("model", healthy), "ok")
+            self.assertEqual(guards.guard("model").breaker.state, "closed")
+
+        asyncio.run(scenario())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from scheduler import FairScheduler, QueueFull
+
+class FairSchedulerTest(unittest.TestCase):
+    def test_keys_take_turns(self):
+        async def scenario():
+            scheduler = FairScheduler(1, 5, 10)
+            order = []
+
+            def job(name):
+                async def run():
+                    order.append(name)
+                    await asyncio.sleep(0)
+                return run
+
+            self.assertEqual(scheduler.submit("a", job("a1")), 0)
+            self.assertEqual(scheduler.submit("a", job("a2")), 1)
+            self.assertEqual(scheduler.submit("a", job("a3")), 2)
+            self.assertEqual(scheduler.submit("b", job("b1")), 3)
+            while scheduler.pending or scheduler.running:
+                await asyncio.sleep(0.01)
+            self.assertEqual(order, ["a1", "b1", "a2", "a3"])
+
+        asyncio.run(scenario())
+
+    def test_queue_limits(self):
+        async def scenario():
+            scheduler = FairScheduler(1, 2, 3)
+            blocker = asyncio.Event()
+            scheduler.submit("a", blocker.wait)
+            scheduler.submit("a", blocker.wait)
+            scheduler.submit("a", blocker.wait)
+            with self.assertRaises(QueueFull) as cm:
+                scheduler.submit("a", blocker.wait)
+            self.assertEqual(cm.exception.scope, "user")
+            scheduler.submit("b", blocker.wait)
+            with self.assertRaises(QueueFull) as cm:
+                scheduler.submit("c", blocker.wait)
+            self.assertEqual(cm.exception.scope, "server")
+            blocker.set()
+
+        asyncio.run(scenario())
+
+    def test_held_job_frees_its_worker(self):
+        async def scenario():
+            scheduler = FairScheduler(1, 5, 10)
+            order = []
+            loop = asyncio.get_running_loop()
+            opens_at = loop.time() + 0.05
+
+            def admit():
+                return max(0, opens_at - loop.time())
+
+            def job(name):
+                async def run():
+                    order.append(name)
+                return run
+
+            self.assertEqual(scheduler.submit("a", job("a1"), admit), 1)
+            self.assertEqual(scheduler.submit("b", job("b1")), 0)
+            self.assertEqual(scheduler.pending, 1)
+            await asyncio.sleep(0.01)
+            # b1 finished and "a" is still held, so the next "b" job runs first
+            scheduler.submit("b", job("b2"))
+            await asyncio.sleep(0.01)
+            self.assertEqual(order, ["b1", "b2"])
+            await asyncio.sleep(0.06)
+            self.assertEqual(order, ["b1", "b2", "a1"])
+            self.assertEqual(scheduler.pending, 0)
+
+        asyncio.run(scenario())
+
+if __name__ == "__main__":
+    unittest.main()
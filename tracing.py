@@ -0,0 +1,143 @@
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+
+log = logging.getLogger(__name__)
+
+# The trace of the command being handled; tasks inherit it when created, and
+# queued jobs set it themselves since they run in the scheduler's tasks
+current_trace = ContextVar("current_trace", default=None)
+
+class Span:
+    """Times a block as one stage of a trace"""
+    __slots__ = ("trace", "name", "start")
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.trace.add_span(self.name, self.start, time.monotonic(), error=exc_type is not None)
+        return False
+
+class NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+NULL_SPAN = NullSpan()
+
+class Trace:
+    """Stage timings for one command, identified by a request id.
+
+    A trace is finished once everything holding it has released it: the
+    handler that started it, plus the queued job if the command was
+    scheduled.
+    """
+    __slots__ = ("request_id", "name", "attrs", "start", "started_at", "spans", "holds", "error")
+
+    def __init__(self, name, attrs):
+        self.request_id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.attrs = attrs
+        self.start = time.monotonic()
+        self.started_at = time.time()
+        self.spans = []
+        self.holds = 1
+        self.error = False
+
+    def span(self, name):
+        return Span(self, name)
+
+    def add_span(self, name, start, end, error=False):
+        self.spans.append((name, start - self.start, end - start, error))
+        self.error = self.error or error
+
+    def hold(self):
+        self.holds += 1
+
+    def to_dict(self, duration):
+        return {
+            "request_id": self.request_id,
+            "name": self.name,
+            "started_at": round(self.started_at, 3),
+            "duration_ms": round(duration * 1000, 1),
+            **self.attrs,
+            "spans": [
+                {"name": name, "offset_ms": round(offset * 1000, 1), "duration_ms": round(length * 1000, 1),
+                 **({"error": True} if error else {})}
+                for name, offset, length, error in self.spans
+            ],
+        }
+
+def span(name):
+    """A span in the current trace, or a no-op outside one"""
+    trace = current_trace.get()
+    return trace.span(name) if trace is not None else NULL_SPAN
+
+class Tracer:
+    """Writes finished traces to a JSONL file on a worker thread.
+
+    A sample_rate fraction of traces is kept; traces slower than
+    slow_threshold seconds or with a failed span are always kept. The file
+    is rotated to <path>.1 once it passes max_bytes.
+    """
+
+    def __init__(self, path, sample_rate, slow_threshold, max_bytes):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.max_bytes = max_bytes
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="trace")
+        self.stats = {"written": 0, "dropped": 0}
+
+    def start(self, name, **attrs):
+        """Start a trace and make it current for this task and any it creates"""
+        trace = Trace(name, attrs)
+        current_trace.set(trace)
+        return trace
+
+    def release(self, trace):
+        trace.holds -= 1
+        if trace.holds > 0:
+            return
+        duration = time.monotonic() - trace.start
+        keep = (duration >= self.slow_threshold or trace.error or
+                random.random() < self.sample_rate)
+        if not self.path or not keep:
+            self.stats["dropped"] += 1
+            return
+        self.stats["written"] += 1
+        line = json.dumps(trace.to_dict(duration))
+        self.executor.submit(self._write, line).add_done_callback(log_failure)
+
+    def _write(self, line):
+        try:
+            if os.path.getsize(self.path) >= self.max_bytes:
+                os.replace(self.path, f"{self.path}.1")
+        except FileNotFoundError:
+            pass
+        with open(self.path, 'a') as f:
+            f.write(line + "\n")
+
+    def flush(self):
+        """Wait for queued writes (used on shutdown)"""
+        self.executor.submit(lambda: None).result()
+
+def log_failure(future):
+    if future.exception():
+        log.error("Error writing trace: %s", future.exception())